@@ -1,5 +1,7 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Optional, Any
+from itertools import islice
+from typing import Optional, Any, Dict, Iterable, Iterator, List, Tuple
 
 class Handler(ABC):
     '''
@@ -16,37 +18,409 @@ class Handler(ABC):
         pass
 
 class AbstractHandler(Handler):
+    '''
+    Поведение цепочки по умолчанию: звено пытается обработать запрос само
+    (метод process), а если не может — передаёт его следующему обработчику.
+
+    Атрибут accepts позволяет обработчику объявить ключи запросов, которые он
+    принимает. Такие обработчики можно «скомпилировать» в таблицу диспетчеризации
+    (см. CompiledChain). Обработчики без accepts считаются предикатными: решение
+    принимается только внутри process.
+
+    Переопределять process не обязательно: обработчик в прежнем стиле, который
+    переопределяет handle и вызывает super().handle(request), продолжает
+    работать. Для него process возвращает None, а ускоренные обходы вызывают
+    его handle целиком.
+    '''
     _next_handler: Handler = None
+    accepts: Optional[Iterable[Any]] = None
 
     def set_next(self, handler: Handler) -> Handler:
         self._next_handler = handler
         return handler
-    
-    @abstractmethod
+
+    def process(self, request: Any) -> Optional[str]:
+        '''
+        Обрабатывает запрос только текущим звеном, не передавая его дальше.
+        Возвращает None, если звено запрос не принимает.
+        '''
+        return None
+
     def handle(self, request: Any) -> Optional[str]:
+        result = self.process(request)
+        if result is not None:
+            return result
         if self._next_handler is not None:
             return self._next_handler.handle(request)
         return None
 
+    def process_many(self, requests: List[Any]) -> List[Optional[str]]:
+        '''
+        Обрабатывает группу запросов текущим звеном. Обработчики, которым выгодна
+        пакетная работа, могут переопределить этот метод.
+        '''
+        return [process_link(self, request) for request in requests]
+
+    def handle_many(self, requests: Iterable[Any]) -> List[Optional[str]]:
+        '''
+        Пропускает пакет запросов через цепочку, начиная с этого звена. Каждое
+        звено вызывается один раз на группу ещё не принятых запросов, а
+        результаты возвращаются в порядке входных данных.
+        '''
+        return handle_batch(chain_links(self), list(requests))
+
+    def iter_handle_many(self, requests: Iterable[Any],
+                         chunk_size: int = 1024) -> Iterator[Optional[str]]:
+        '''
+        Потоковый вариант handle_many: читает вход порциями по chunk_size и
+        отдаёт результаты по мере обработки, не держа весь вход в памяти.
+        '''
+        links = list(chain_links(self))
+        requests = iter(requests)
+        while True:
+            chunk = list(islice(requests, chunk_size))
+            if not chunk:
+                return
+            yield from handle_batch(links, chunk)
+
+
 class MonkeyHandler(AbstractHandler):
-    def handle(self, request: str) -> Optional[str]:
+    accepts = ('banana',)
+
+    def process(self, request: str) -> Optional[str]:
         if request == 'banana':
             return f"Monkey: I`m eating {request}"
-        return super().handle(request)
+        return None
 
 
 class SquirrelHandler(AbstractHandler):
-    def handle(self, request: str) -> Optional[str]:
+    accepts = ('nut',)
+
+    def process(self, request: str) -> Optional[str]:
         if request == 'nut':
             return f"Squirrel: I`m eating {request}"
-        return super().handle(request)
+        return None
 
 
 class DogHandler(AbstractHandler):
-    def handle(self, request: str) -> Optional[str]:
+    accepts = ('meat',)
+
+    def process(self, request: str) -> Optional[str]:
         if request == 'meat':
             return f"Dog: I`m eating {request}"
-        return super().handle(request)
+        return None
+
+
+def chain_links(handler: Handler) -> Iterator[Handler]:
+    '''
+    Обходит звенья цепочки, построенной через set_next, без рекурсии.
+    '''
+    seen = set()
+    while handler is not None and id(handler) not in seen:
+        seen.add(id(handler))
+        yield handler
+        handler = getattr(handler, '_next_handler', None)
+
+
+def process_link(handler: Handler, request: Any) -> Optional[str]:
+    '''
+    Обрабатывает запрос одним звеном, не передавая его по цепочке.
+    '''
+    process = getattr(type(handler), 'process', None)
+    if process is not None and process is not AbstractHandler.process:
+        return handler.process(request)
+    # Обработчик без собственного process (чужой или в прежнем стиле с
+    # переопределённым handle) сам передаёт запрос дальше, поэтому его
+    # результат окончательный.
+    return handler.handle(request)
+
+
+def handle_batch(links: Iterable[Handler], requests: List[Any]) -> List[Optional[str]]:
+    '''
+    Маршрутизирует пакет запросов по звеньям: каждое звено получает только те
+    запросы, которые не приняли предыдущие звенья (ключевые обработчики — ещё и
+    только подходящие по accepts).
+    '''
+    results: List[Optional[str]] = [None] * len(requests)
+    pending = list(range(len(requests)))
+    for handler in links:
+        if not pending:
+            break
+        keys = getattr(handler, 'accepts', None)
+        if keys is not None:
+            keys = frozenset(keys)
+            group = [i for i in pending if _is_accepted(requests[i], keys)]
+        else:
+            group = pending
+        if not group:
+            continue
+
+        process_many = getattr(handler, 'process_many', None)
+        if process_many is not None:
+            answers = process_many([requests[i] for i in group])
+        else:
+            answers = [process_link(handler, requests[i]) for i in group]
+
+        claimed = set()
+        for i, answer in zip(group, answers):
+            if answer is not None:
+                results[i] = answer
+                claimed.add(i)
+        if claimed:
+            pending = [i for i in pending if i not in claimed]
+    return results
+
+
+def _is_accepted(request: Any, keys: frozenset) -> bool:
+    try:
+        return request in keys
+    except TypeError:
+        return False
+
+
+class CompiledChain(Handler):
+    '''
+    Скомпилированная цепочка превращает список звеньев в словарь «ключ запроса
+    -> обработчик», поэтому поиск обработчика для ключевых запросов стоит O(1),
+    а не O(n) рекурсивных вызовов. Линейный проход остаётся только для
+    предикатных обработчиков, стоящих в цепочке раньше найденного по ключу.
+    Семантика «побеждает первый подходящий» сохраняется.
+    '''
+
+    def __init__(self, head: Handler):
+        self._links: List[Handler] = list(chain_links(head))
+        self._compile()
+
+    def _compile(self) -> None:
+        self._table: Dict[Any, Tuple[int, Handler]] = {}
+        self._predicates: List[Tuple[int, Handler]] = []
+        for index, handler in enumerate(self._links):
+            keys = getattr(handler, 'accepts', None)
+            if keys is None or not hasattr(handler, 'process'):
+                self._predicates.append((index, handler))
+                continue
+            for key in keys:
+                self._table.setdefault(key, (index, handler))
+
+    def set_next(self, handler: Handler) -> Handler:
+        '''
+        Добавляет звенья в конец скомпилированной цепочки и перестраивает
+        таблицу.
+        '''
+        self._links.extend(chain_links(handler))
+        self._compile()
+        return handler
+
+    def handle(self, request: Any) -> Optional[str]:
+        try:
+            entry = self._table.get(request)
+        except TypeError:
+            entry = None
+        limit = entry[0] if entry is not None else len(self._links)
+
+        for index, handler in self._predicates:
+            if index >= limit:
+                break
+            result = process_link(handler, request)
+            if result is not None:
+                return result
+
+        if entry is None:
+            return None
+        result = process_link(entry[1], request)
+        if result is not None:
+            return result
+        # Обработчик объявил ключ, но отказался от запроса — продолжаем обход
+        # так же, как это сделала бы обычная цепочка.
+        for handler in self._links[limit + 1:]:
+            result = process_link(handler, request)
+            if result is not None:
+                return result
+        return None
+
+
+class ChainRunner(Handler):
+    '''
+    Итеративный исполнитель цепочки обходит звенья циклом, поэтому длина
+    цепочки не ограничена глубиной рекурсии интерпретатора.
+
+    В адаптивном режиме исполнитель считает попадания каждого звена и
+    продвигает «горячие» звенья ближе к началу. Переставляются только
+    независимые от порядка звенья — ключевые обработчики с непересекающимися
+    accepts, так что результат обработки не меняется. Если все звенья ключевые,
+    запросы вне объединения их ключей отклоняются сразу, без обхода цепочки.
+    '''
+
+    def __init__(self, head: Handler, adaptive: bool = False):
+        self._links: List[Handler] = list(chain_links(head))
+        self._adaptive = adaptive
+        self._refresh()
+
+    def _refresh(self) -> None:
+        self._hits: List[int] = [0] * len(self._links)
+        self._keys: List[Optional[frozenset]] = []
+        for handler in self._links:
+            keys = getattr(handler, 'accepts', None)
+            self._keys.append(frozenset(keys) if keys is not None else None)
+        self._known_keys: Optional[frozenset] = None
+        if self._keys and all(keys is not None for keys in self._keys):
+            self._known_keys = frozenset().union(*self._keys)
+
+    @property
+    def links(self) -> List[Handler]:
+        return list(self._links)
+
+    def set_next(self, handler: Handler) -> Handler:
+        self._links.extend(chain_links(handler))
+        self._refresh()
+        return handler
+
+    def handle(self, request: Any) -> Optional[str]:
+        if self._adaptive and self._known_keys is not None:
+            try:
+                if request not in self._known_keys:
+                    return None
+            except TypeError:
+                return None
+
+        for index, handler in enumerate(self._links):
+            result = process_link(handler, request)
+            if result is not None:
+                if self._adaptive:
+                    self._promote(index)
+                return result
+        return None
+
+    def _promote(self, index: int) -> None:
+        '''
+        Меняет звено местами с предыдущим, если оно попадает чаще и перестановка
+        не влияет на то, кто первым примет запрос.
+        '''
+        self._hits[index] += 1
+        if index == 0 or self._hits[index] <= self._hits[index - 1]:
+            return
+        keys, previous_keys = self._keys[index], self._keys[index - 1]
+        if keys is None or previous_keys is None or keys & previous_keys:
+            return
+        for items in (self._links, self._hits, self._keys):
+            items[index - 1], items[index] = items[index], items[index - 1]
+
+
+class AsyncHandler(ABC):
+    '''
+    Асинхронный вариант интерфейса Обработчика для звеньев, которым нужно
+    выполнить ввод-вывод, прежде чем решить, принимать ли запрос.
+    '''
+
+    @abstractmethod
+    def set_next(self, handler: 'AsyncHandler') -> 'AsyncHandler':
+        pass
+
+    @abstractmethod
+    async def handle(self, request: Any) -> Optional[str]:
+        pass
+
+
+class AsyncAbstractHandler(AsyncHandler):
+    _next_handler: AsyncHandler = None
+    accepts: Optional[Iterable[Any]] = None
+
+    def set_next(self, handler: AsyncHandler) -> AsyncHandler:
+        self._next_handler = handler
+        return handler
+
+    @abstractmethod
+    async def process(self, request: Any) -> Optional[str]:
+        pass
+
+    async def handle(self, request: Any) -> Optional[str]:
+        handler = self
+        while handler is not None:
+            result = await handler.process(request)
+            if result is not None:
+                return result
+            handler = handler._next_handler
+        return None
+
+
+class AsyncFoodHandler(AsyncAbstractHandler):
+    '''
+    Звено, которое перед ответом «сходит» во внешнюю систему — задержка
+    имитирует ввод-вывод.
+    '''
+    animal: str = None
+    food: str = None
+
+    def __init__(self, latency: float = 0.0):
+        self._latency = latency
+        self.accepts = (self.food,)
+
+    async def process(self, request: str) -> Optional[str]:
+        await asyncio.sleep(self._latency)
+        if request == self.food:
+            return f"{self.animal}: I`m eating {request}"
+        return None
+
+
+class AsyncMonkeyHandler(AsyncFoodHandler):
+    animal = 'Monkey'
+    food = 'banana'
+
+
+class AsyncSquirrelHandler(AsyncFoodHandler):
+    animal = 'Squirrel'
+    food = 'nut'
+
+
+class AsyncDogHandler(AsyncFoodHandler):
+    animal = 'Dog'
+    food = 'meat'
+
+
+class SpeculativeChain(AsyncHandler):
+    '''
+    Спекулятивная цепочка запускает process у следующих window звеньев
+    одновременно, поэтому задержки звеньев не складываются. Результаты
+    разбираются в порядке цепочки: побеждает первое звено с ответом не None,
+    а ещё не завершённые проверки менее приоритетных звеньев отменяются.
+    '''
+
+    def __init__(self, head: AsyncHandler, window: int = 4):
+        if window < 1:
+            raise ValueError("window must be positive")
+        self._links: List[AsyncHandler] = list(chain_links(head))
+        self._window = window
+
+    def set_next(self, handler: AsyncHandler) -> AsyncHandler:
+        self._links.extend(chain_links(handler))
+        return handler
+
+    async def handle(self, request: Any) -> Optional[str]:
+        for start in range(0, len(self._links), self._window):
+            window = self._links[start:start + self._window]
+            tasks = [asyncio.ensure_future(handler.process(request))
+                     for handler in window]
+            try:
+                for task in tasks:
+                    result = await task
+                    if result is not None:
+                        return result
+            finally:
+                for task in tasks:
+                    if not task.done():
+                        task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        return None
+
+
+async def async_client_code(handler: AsyncHandler):
+    for food in ('nut', 'banana', 'meat', 'coffe'):
+        print(f"Client: Who wants a {food}?")
+        result = await handler.handle(food)
+        if result is not None:
+            print(f"  {result}")
+        else:
+            print(f"  Food {food} was left untouched.")
 
 
 def client_code(handler: Handler):
@@ -78,4 +452,34 @@ if __name__ == "__main__":
     print("\n")
 
     print("Subchain: Squirrel > Dog")
-    client_code(squirrel)
\ No newline at end of file
+    client_code(squirrel)
+    print("\n")
+
+    # Скомпилированная цепочка отвечает так же, как исходная, но ищет
+    # обработчик по таблице.
+    print("Compiled chain: Monkey > Squirrel > Dog")
+    client_code(CompiledChain(monkey))
+    print("\n")
+
+    # Адаптивный исполнитель обходит цепочку без рекурсии и поднимает наверх
+    # звенья, которые срабатывают чаще других.
+    print("Adaptive runner: Monkey > Squirrel > Dog")
+    runner = ChainRunner(monkey, adaptive=True)
+    client_code(runner)
+    print("Runner order:", ' > '.join(type(link).__name__ for link in runner.links))
+    print("\n")
+
+    # Пакетная обработка: каждое звено вызывается один раз на свою группу.
+    print("Batch: Monkey > Squirrel > Dog")
+    foods = ['nut', 'banana', 'meat', 'coffe', 'banana']
+    for food, result in zip(foods, monkey.handle_many(foods)):
+        print(f"  {food}: {result}")
+    print("\n")
+
+    # Асинхронная цепочка: спекулятивный режим проверяет звенья одновременно,
+    # но отвечает то же звено, что и при последовательном обходе.
+    async_monkey = AsyncMonkeyHandler(latency=0.01)
+    async_monkey.set_next(AsyncSquirrelHandler(latency=0.01)).set_next(
+        AsyncDogHandler(latency=0.01))
+    print("Speculative async chain: Monkey > Squirrel > Dog")
+    asyncio.run(async_client_code(SpeculativeChain(async_monkey, window=3)))
\ No newline at end of file
@@ -1,4 +1,13 @@
+import heapq
+import mmap
+import os
+import struct
+import time
+import zlib
 from abc import ABC, abstractmethod
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from threading import BoundedSemaphore, Condition, Lock, Thread, Timer
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Type
 
 
 class Receiver:
@@ -15,6 +24,22 @@ class Receiver:
         print(f"Receiver: Also working on ({mes})")
 
 
+class BulkReceiver(Receiver):
+    '''
+    Получатель, который умеет выполнить одну операцию сразу для многих
+    сообщений. Bulk-методы возвращают результат для каждого сообщения (или
+    исключение на его месте), чтобы ошибки дошли до конкретных команд.
+    '''
+
+    def do_something_bulk(self, messages: List[str]) -> List[Any]:
+        print(f"Receiver: Working on ({', '.join(messages)})")
+        return [None] * len(messages)
+
+    def do_something_else_bulk(self, messages: List[str]) -> List[Any]:
+        print(f"Receiver: Also working on ({', '.join(messages)})")
+        return [None] * len(messages)
+
+
 class Command(ABC):
     '''
     Интерфейс Команды объявляет метод для выполнения команд.
@@ -24,8 +49,36 @@ class Command(ABC):
     def execute(self) -> None:
         pass
 
+    def operations(self) -> Optional[List[Tuple[Receiver, str, str]]]:
+        '''
+        Операции над получателями, которые выполняет команда: (получатель,
+        имя метода, сообщение). None означает, что команду нельзя объединять с
+        другими и её нужно выполнить целиком.
+        '''
+        return None
 
-class SimpleCommand(Command):
+
+class JournaledCommand(Command):
+    '''
+    Команда, которую можно записать в CommandJournal. В журнал попадают только
+    команды этого вида, зарегистрированные под своим тегом.
+    '''
+
+    @abstractmethod
+    def to_record(self) -> Tuple[str, ...]:
+        '''
+        Поля команды для журнала. Получатель в журнал не пишется — при
+        воспроизведении его передают заново.
+        '''
+        pass
+
+    @classmethod
+    @abstractmethod
+    def from_record(cls, receiver: Receiver, fields: Tuple[str, ...]) -> 'JournaledCommand':
+        pass
+
+
+class SimpleCommand(JournaledCommand):
     '''
     Некоторые команды способны выполнять простые операции самостоятельно.
     '''
@@ -33,11 +86,18 @@ class SimpleCommand(Command):
     def __init__(self, payload: str):
         self._payload = payload
 
+    def to_record(self) -> Tuple[str, ...]:
+        return (self._payload,)
+
+    @classmethod
+    def from_record(cls, receiver: Receiver, fields: Tuple[str, ...]) -> 'SimpleCommand':
+        return cls(*fields)
+
     def execute(self) -> None:
         print(f"SimpleCommand: execute -> {self._payload}")
 
 
-class ComplexCommand(Command):
+class ComplexCommand(JournaledCommand):
     '''
     Но есть и команды, которые делегируют более сложные операции другим
     объектам, называемым «получателями».
@@ -52,6 +112,19 @@ class ComplexCommand(Command):
         self._mes_a = mes_a
         self._mes_b = mes_b
 
+    def to_record(self) -> Tuple[str, ...]:
+        return (self._mes_a, self._mes_b)
+
+    def operations(self) -> Optional[List[Tuple[Receiver, str, str]]]:
+        return [
+            (self._receiver, 'do_something', self._mes_a),
+            (self._receiver, 'do_something_else', self._mes_b),
+        ]
+
+    @classmethod
+    def from_record(cls, receiver: Receiver, fields: Tuple[str, ...]) -> 'ComplexCommand':
+        return cls(receiver, *fields)
+
     def execute(self) -> None:
         print("ComplexCommand")
         self._receiver.do_something(self._mes_a)
@@ -84,6 +157,646 @@ class Invoker:
             self._on_finish.execute()
 
 
+def _execute_command(command: Command) -> None:
+    '''
+    Функция верхнего уровня, чтобы команду можно было передать и в пул
+    процессов.
+    '''
+    return command.execute()
+
+
+class ExecutorInvoker(Invoker):
+    '''
+    Отправитель, который не выполняет команды в своём потоке, а ставит их в
+    ограниченную очередь пула потоков или процессов и сразу возвращает Future.
+    Когда очередь заполнена, submit блокирует вызывающего (обратное давление).
+    При shutdown отправитель дожидается выполнения уже принятых команд.
+    '''
+
+    def __init__(self, executor: Executor = None, max_pending: int = 64):
+        self._executor = executor or ThreadPoolExecutor()
+        self._slots = BoundedSemaphore(max_pending)
+        self._closed = False
+
+    def submit(self, command: Command) -> Future:
+        if self._closed:
+            raise RuntimeError("Invoker is shut down")
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(_execute_command, command)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def submit_all(self, commands: Iterable[Command]) -> List[Future]:
+        return [self.submit(command) for command in commands]
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._closed = True
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self) -> 'ExecutorInvoker':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+
+
+class CoalescingInvoker(Invoker):
+    '''
+    Отправитель копит команды в окне (по размеру max_batch или по времени
+    window секунд) и выполняет их пачкой. Операции разных команд над одним
+    получателем с одним именем метода сливаются в один bulk-вызов, если
+    получатель его поддерживает. Операции команды выполняются по порядку: если
+    первая упала, вторая для этой команды уже не вызывается. Каждая команда
+    получает свой Future: для команды с operations() его результат — список
+    результатов её операций по порядку, для остальных — результат execute,
+    а при сбое — ошибка.
+    '''
+
+    def __init__(self, max_batch: int = 64, window: float = 0.01):
+        self._max_batch = max_batch
+        self._window = window
+        self._batch: List[Tuple[Command, Future]] = []
+        self._lock = Lock()
+        # Пачки выполняются строго по одной: получатель никогда не вызывается
+        # из двух потоков одновременно, даже если таймер и переполнение
+        # окна сработали разом.
+        self._run_lock = Lock()
+        self._timer: Optional[Timer] = None
+
+    def submit(self, command: Command) -> Future:
+        future = Future()
+        with self._lock:
+            self._batch.append((command, future))
+            full = len(self._batch) >= self._max_batch
+            if not full and self._timer is None:
+                self._timer = Timer(self._window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+        return future
+
+    def flush(self) -> None:
+        with self._run_lock:
+            with self._lock:
+                batch, self._batch = self._batch, []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if batch:
+                self._run(batch)
+
+    def _run(self, batch: List[Tuple[Command, Future]]) -> None:
+        pending: List[Tuple[Future, List[Tuple[Receiver, str, str]], List[Any]]] = []
+        for command, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            operations = command.operations()
+            if operations is None:
+                try:
+                    future.set_result(command.execute())
+                except Exception as error:
+                    future.set_exception(error)
+            elif not operations:
+                future.set_result([])
+            else:
+                pending.append((future, operations, []))
+
+        step = 0
+        while pending:
+            groups: Dict[Tuple[int, str], List[Tuple[Future, Receiver, str, List[Any]]]] = {}
+            for future, operations, results in pending:
+                receiver, operation, message = operations[step]
+                groups.setdefault((id(receiver), operation), []).append(
+                    (future, receiver, message, results))
+
+            failed = set()
+            for (_, operation), calls in groups.items():
+                receiver = calls[0][1]
+                messages = [message for _, _, message, _ in calls]
+                for (future, _, _, results), outcome in zip(
+                        calls, self._call(receiver, operation, messages)):
+                    if isinstance(outcome, Exception):
+                        future.set_exception(outcome)
+                        failed.add(id(future))
+                    else:
+                        results.append(outcome)
+
+            step += 1
+            remaining = []
+            for future, operations, results in pending:
+                if id(future) in failed:
+                    continue
+                if step == len(operations):
+                    future.set_result(results)
+                else:
+                    remaining.append((future, operations, results))
+            pending = remaining
+
+    @staticmethod
+    def _call(receiver: Receiver, operation: str, messages: List[str]) -> List[Any]:
+        bulk = getattr(receiver, f"{operation}_bulk", None)
+        if bulk is not None and len(messages) > 1:
+            try:
+                outcomes = list(bulk(messages))
+            except Exception as error:
+                return [error] * len(messages)
+            if len(outcomes) != len(messages):
+                error = RuntimeError(
+                    f"{operation}_bulk returned {len(outcomes)} results for {len(messages)} messages")
+                return [error] * len(messages)
+            return outcomes
+
+        outcomes: List[Any] = []
+        method = getattr(receiver, operation)
+        for message in messages:
+            try:
+                outcomes.append(method(message))
+            except Exception as error:
+                outcomes.append(error)
+        return outcomes
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> 'CoalescingInvoker':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class DeadlineExceeded(Exception):
+    '''
+    Команда не успела начать выполнение до своего крайнего срока.
+    '''
+
+
+class CommandScheduler(Invoker):
+    '''
+    Планировщик держит готовые команды в куче, упорядоченной по приоритету
+    (меньшее число — срочнее), затем по крайнему сроку и по порядку поступления.
+    Рабочие потоки забирают из кучи самую срочную команду. Просроченные
+    команды не выполняются: их Future завершается ошибкой DeadlineExceeded
+    (expired='fail') или отменяется (expired='drop'). Срок отслеживает
+    отдельный поток, поэтому Future завершается вовремя, даже если все
+    рабочие потоки заняты долгими командами.
+    '''
+
+    def __init__(self, workers: int = 1, expired: str = 'fail'):
+        if expired not in ('fail', 'drop'):
+            raise ValueError("expired must be 'fail' or 'drop'")
+        self._expired_policy = expired
+        # Обе кучи хранят только ключи; живые записи лежат в _entries. Запись,
+        # снятая через одну кучу, в другой остаётся и пропускается при выборке.
+        self._heap: List[Tuple[int, float, int]] = []
+        self._deadlines: List[Tuple[float, int]] = []
+        self._entries: Dict[int, Tuple[Command, Future, float, float]] = {}
+        lock = Lock()
+        self._condition = Condition(lock)
+        self._deadline_changed = Condition(lock)
+        self._sequence = 0
+        self._closed = False
+        self._executed = 0
+        self._expired = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._threads = [Thread(target=self._work, daemon=True) for _ in range(workers)]
+        self._threads.append(Thread(target=self._watch_deadlines, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, command: Command, priority: int = 0,
+               deadline: Optional[float] = None) -> Future:
+        '''
+        deadline — сколько секунд с момента постановки команда может ждать
+        начала выполнения.
+        '''
+        future = Future()
+        now = time.monotonic()
+        expires = now + deadline if deadline is not None else float('inf')
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Scheduler is shut down")
+            sequence = self._sequence
+            self._sequence += 1
+            self._entries[sequence] = (command, future, expires, now)
+            heapq.heappush(self._heap, (priority, expires, sequence))
+            if deadline is not None:
+                heapq.heappush(self._deadlines, (expires, sequence))
+                if self._deadlines[0][1] == sequence:
+                    self._deadline_changed.notify()
+            self._condition.notify()
+        return future
+
+    def _record_wait(self, wait: float) -> None:
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+
+    def _sweep(self, now: float) -> List[Tuple[Future, float]]:
+        '''
+        Снимает с очереди все команды, чей срок уже истёк, не дожидаясь, пока
+        до них дойдёт очередь по приоритету. Вызывается под _condition;
+        Future завершаются потом, вне блокировки.
+        '''
+        expired = []
+        while self._deadlines and now > self._deadlines[0][0]:
+            _, sequence = heapq.heappop(self._deadlines)
+            entry = self._entries.pop(sequence, None)
+            if entry is None:
+                continue
+            _, future, _, enqueued = entry
+            self._expired += 1
+            self._record_wait(now - enqueued)
+            expired.append((future, now - enqueued))
+        return expired
+
+    def _expire(self, expired: List[Tuple[Future, float]]) -> None:
+        for future, wait in expired:
+            if self._expired_policy == 'fail':
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(DeadlineExceeded(f"waited {wait:.3f}s"))
+            else:
+                future.cancel()
+
+    def _watch_deadlines(self) -> None:
+        '''
+        Спит до ближайшего крайнего срока и снимает просроченные команды.
+        '''
+        while True:
+            with self._deadline_changed:
+                while True:
+                    now = time.monotonic()
+                    expired = self._sweep(now)
+                    if expired:
+                        break
+                    if self._closed and not self._deadlines:
+                        return
+                    timeout = self._deadlines[0][0] - now if self._deadlines else None
+                    self._deadline_changed.wait(timeout)
+            self._expire(expired)
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._entries and not self._closed:
+                    self._condition.wait()
+                now = time.monotonic()
+                # Срок мог истечь, пока сторож ещё не проснулся.
+                expired = self._sweep(now)
+                entry = None
+                while self._heap and entry is None:
+                    _, _, sequence = heapq.heappop(self._heap)
+                    entry = self._entries.pop(sequence, None)
+                if entry is None and not expired and self._closed:
+                    return
+                if entry is not None:
+                    command, future, _, enqueued = entry
+                    self._executed += 1
+                    self._record_wait(now - enqueued)
+
+            self._expire(expired)
+            if entry is None or not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(command.execute())
+            except Exception as error:
+                future.set_exception(error)
+
+    def metrics(self) -> Dict[str, float]:
+        with self._condition:
+            dequeued = self._executed + self._expired
+            return {
+                'queue_depth': len(self._entries),
+                'executed': self._executed,
+                'expired': self._expired,
+                'avg_wait': self._total_wait / dequeued if dequeued else 0.0,
+                'max_wait': self._max_wait,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        '''
+        Прекращает приём команд; рабочие потоки дорабатывают очередь.
+        '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            self._deadline_changed.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self) -> 'CommandScheduler':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+
+
+class JournalFailed(Exception):
+    '''
+    Журнал не смог сбросить записи на диск. Команды, ожидавшие этот сброс,
+    не выполнены, а журнал больше не принимает записей.
+    '''
+
+
+class CommandJournal:
+    '''
+    Журнал упреждающей записи (write-ahead log) для команд. Команда попадает в
+    журнал до выполнения: append возвращает управление только после того, как
+    запись сброшена на диск. Записи разных вызывающих копятся в буфере и
+    сбрасываются группой — один fsync на group_size команд или не позже чем
+    через max_latency секунд после первой записи группы.
+
+    Файл журнала начинается с заголовка с номером поколения. Снимок хранит
+    поколение, которое он покрывает, а после снимка журнал атомарно
+    заменяется пустым журналом следующего поколения. Если сбой произошёл
+    между этими шагами, записи старого поколения при воспроизведении
+    пропускаются, и команды не применяются дважды.
+
+    Формат записи: длина и crc32 полезной нагрузки, затем тег типа команды и
+    поля, каждое с префиксом длины. Повреждённый или недописанный хвост
+    журнала отбрасывается.
+
+    Если запись или fsync завершились ошибкой, что именно попало на диск,
+    неизвестно. Журнал переходит в состояние отказа: все ожидающие append
+    получают JournalFailed, и новые записи не принимаются.
+    '''
+    _log_header = struct.Struct('<4sQ')
+    _magic = b'CJNL'
+    _generation_header = struct.Struct('<Q')
+    _header = struct.Struct('<II')
+    _field = struct.Struct('<I')
+    _types: Dict[int, Type[JournaledCommand]] = {}
+
+    @classmethod
+    def register(cls, tag: int, command_type: Type[Command]) -> None:
+        if not issubclass(command_type, JournaledCommand):
+            raise TypeError(f"{command_type.__name__} is not a JournaledCommand")
+        cls._types[tag] = command_type
+
+    def __init__(self, path: str, group_size: int = 128, max_latency: float = 0.005):
+        self._path = path
+        self._snapshot_path = f"{path}.snapshot"
+        self._group_size = group_size
+        self._max_latency = max_latency
+        self._buffer = bytearray()
+        self._pending = 0
+        self._appended = 0
+        self._durable = 0
+        self._condition = Condition()
+        self._io_lock = Lock()
+        self._timer: Optional[Timer] = None
+        self._failure: Optional[BaseException] = None
+        if not os.path.exists(path) or os.path.getsize(path) < self._log_header.size:
+            self._replace_log(0)
+        else:
+            self._open_log()
+        self._recover()
+
+    def _open_log(self) -> None:
+        with open(self._path, 'rb') as file:
+            magic, self._generation = self._log_header.unpack(file.read(self._log_header.size))
+        if magic != self._magic:
+            raise ValueError(f"{self._path} is not a command journal")
+        self._file = open(self._path, 'ab')
+
+    def _replace_log(self, generation: int) -> None:
+        '''
+        Атомарно заменяет журнал пустым журналом поколения generation.
+        '''
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(self._log_header.pack(self._magic, generation))
+            file.flush()
+            os.fsync(file.fileno())
+        if getattr(self, '_file', None) is not None:
+            self._file.close()
+        os.replace(tmp_path, self._path)
+        self._sync_directory()
+        self._open_log()
+
+    def _sync_directory(self) -> None:
+        if os.name != 'posix':
+            return
+        descriptor = os.open(os.path.dirname(os.path.abspath(self._path)), os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+    def _encode(self, command: Command) -> bytes:
+        for tag, command_type in self._types.items():
+            if type(command) is command_type:
+                break
+        else:
+            raise TypeError(f"{type(command).__name__} is not registered in the journal")
+        fields = command.to_record()
+        payload = bytearray(struct.pack('<BB', tag, len(fields)))
+        for field in fields:
+            data = field.encode('utf-8')
+            payload += self._field.pack(len(data))
+            payload += data
+        return self._header.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def append(self, command: Command) -> None:
+        '''
+        Добавляет команду в журнал и ждёт, пока её группа будет сброшена на
+        диск.
+        '''
+        record = self._encode(command)
+        with self._condition:
+            self._check_failure()
+            self._buffer += record
+            self._pending += 1
+            self._appended += 1
+            number = self._appended
+            full = self._pending >= self._group_size
+            if not full and self._timer is None:
+                self._timer = Timer(self._max_latency, self._commit_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.commit()
+        with self._condition:
+            while self._durable < number and self._failure is None:
+                self._condition.wait()
+            if self._durable < number:
+                self._check_failure()
+
+    def _check_failure(self) -> None:
+        if self._failure is not None:
+            raise JournalFailed(f"journal {self._path} failed: {self._failure!r}") from self._failure
+
+    def _commit_on_timer(self) -> None:
+        try:
+            self.commit()
+        except JournalFailed:
+            # Ожидающие append уже получили ошибку.
+            pass
+
+    def execute(self, command: Command) -> None:
+        '''
+        Записывает команду в журнал и выполняет её.
+        '''
+        self.append(command)
+        command.execute()
+
+    def commit(self) -> None:
+        with self._io_lock:
+            with self._condition:
+                self._check_failure()
+                data, self._buffer = self._buffer, bytearray()
+                upto = self._appended
+                self._pending = 0
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if data:
+                position = self._file.tell()
+                try:
+                    self._file.write(data)
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                except BaseException as error:
+                    self._fail(error, position)
+            with self._condition:
+                self._durable = max(self._durable, upto)
+                self._condition.notify_all()
+
+    def _fail(self, error: BaseException, position: int) -> None:
+        '''
+        Переводит журнал в состояние отказа и будит всех ожидающих. Группа,
+        которую не удалось записать, по возможности отрезается, чтобы
+        невыполненные команды не воскресли при воспроизведении.
+        '''
+        with self._condition:
+            self._failure = error
+            self._buffer = bytearray()
+            self._pending = 0
+            self._condition.notify_all()
+        try:
+            self._file.truncate(position)
+        except OSError:
+            pass
+        self._check_failure()
+
+    def _scan(self) -> Iterator[Tuple[int, bytes]]:
+        '''
+        Последовательно читает журнал через mmap и отдаёт целые записи вместе
+        со смещением их конца.
+        '''
+        with open(self._path, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            offset, end = self._log_header.size, len(view)
+            while offset + self._header.size <= end:
+                length, checksum = self._header.unpack_from(view, offset)
+                start = offset + self._header.size
+                if start + length > end:
+                    break
+                payload = view[start:start + length]
+                if zlib.crc32(payload) != checksum:
+                    break
+                offset = start + length
+                yield offset, payload
+
+    def _recover(self) -> None:
+        '''
+        Отрезает недописанный хвост, оставшийся после сбоя, чтобы новые записи
+        не оказались за ним.
+        '''
+        valid_end = self._log_header.size
+        for valid_end, _ in self._scan():
+            pass
+        if valid_end < os.path.getsize(self._path):
+            self._file.truncate(valid_end)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def records(self, receiver: Receiver) -> Iterator[Command]:
+        self.commit()
+        covered = self._snapshot_generation()
+        if covered is not None and covered >= self._generation:
+            return
+        for _, payload in self._scan():
+            yield self._decode(receiver, payload)
+
+    def _decode(self, receiver: Receiver, payload: bytes) -> Command:
+        tag, count = struct.unpack_from('<BB', payload)
+        offset, fields = 2, []
+        for _ in range(count):
+            (length,) = self._field.unpack_from(payload, offset)
+            offset += self._field.size
+            fields.append(payload[offset:offset + length].decode('utf-8'))
+            offset += length
+        return self._types[tag].from_record(receiver, tuple(fields))
+
+    def replay(self, receiver: Receiver) -> int:
+        '''
+        Выполняет заново все команды журнала, не покрытые снимком, и
+        возвращает их количество.
+        '''
+        count = 0
+        for command in self.records(receiver):
+            command.execute()
+            count += 1
+        return count
+
+    def snapshot(self, state: bytes) -> None:
+        '''
+        Атомарно сохраняет снимок состояния и начинает новое поколение
+        журнала: команды до снимка больше не нужны для восстановления.
+        '''
+        self.commit()
+        with self._io_lock:
+            tmp_path = f"{self._snapshot_path}.tmp"
+            with open(tmp_path, 'wb') as file:
+                file.write(self._generation_header.pack(self._generation))
+                file.write(state)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self._snapshot_path)
+            self._sync_directory()
+            self._replace_log(self._generation + 1)
+
+    def _read_snapshot(self) -> Optional[Tuple[int, bytes]]:
+        if not os.path.exists(self._snapshot_path):
+            return None
+        with open(self._snapshot_path, 'rb') as file:
+            data = file.read()
+        (generation,) = self._generation_header.unpack_from(data)
+        return generation, data[self._generation_header.size:]
+
+    def _snapshot_generation(self) -> Optional[int]:
+        snapshot = self._read_snapshot()
+        return snapshot[0] if snapshot is not None else None
+
+    def load_snapshot(self) -> Optional[bytes]:
+        snapshot = self._read_snapshot()
+        return snapshot[1] if snapshot is not None else None
+
+    def close(self) -> None:
+        try:
+            if self._failure is None:
+                self.commit()
+        finally:
+            self._file.close()
+
+    def __enter__(self) -> 'CommandJournal':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+CommandJournal.register(1, SimpleCommand)
+CommandJournal.register(2, ComplexCommand)
+
+
 if __name__ == "__main__":
     command_a = SimpleCommand('Say hi')
     
@@ -93,4 +806,54 @@ if __name__ == "__main__":
     invoker = Invoker()
     invoker.set_command_on_start(command_a)
     invoker.set_command_on_finish(command_b)
-    invoker.do_something_important()
\ No newline at end of file
+    invoker.do_something_important()
+
+    print('')
+
+    # Отправитель на пуле потоков: команды выполняются параллельно, клиент
+    # получает Future для каждой из них.
+    with ExecutorInvoker(ThreadPoolExecutor(max_workers=2), max_pending=4) as pool_invoker:
+        futures = pool_invoker.submit_all([
+            SimpleCommand('Say hi from pool'),
+            ComplexCommand(receiver, 'Pool start', 'Pool finish'),
+        ])
+        for future in futures:
+            future.result()
+
+    print('')
+
+    # Журнал команд: после сбоя состояние восстанавливается воспроизведением.
+    from tempfile import TemporaryDirectory
+    with TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'commands.wal')
+        with CommandJournal(path, group_size=2) as journal:
+            journal.execute(SimpleCommand('Journaled hi'))
+            journal.execute(ComplexCommand(receiver, 'Journaled start', 'Journaled finish'))
+
+        print("Client: Replaying journal")
+        with CommandJournal(path) as journal:
+            print(f"Client: Replayed {journal.replay(Receiver())} commands")
+
+    print('')
+
+    # Объединение команд: три команды к одному получателю превращаются в два
+    # bulk-вызова.
+    bulk_receiver = BulkReceiver()
+    with CoalescingInvoker(max_batch=3) as coalescing_invoker:
+        futures = [
+            coalescing_invoker.submit(ComplexCommand(bulk_receiver, f"start {i}", f"finish {i}"))
+            for i in range(3)
+        ]
+    for future in futures:
+        future.result()
+
+    print('')
+
+    # Планировщик: срочная команда обгоняет фоновые, просроченная не
+    # выполняется вовсе.
+    with CommandScheduler(workers=1) as scheduler:
+        scheduler.submit(SimpleCommand('Warm up'))
+        scheduler.submit(SimpleCommand('Bulk report'), priority=10)
+        scheduler.submit(SimpleCommand('Stale request'), priority=5, deadline=0)
+        scheduler.submit(SimpleCommand('Urgent request'), priority=0)
+    print(f"Scheduler metrics: {scheduler.metrics()}")
@@ -1,5 +1,15 @@
-from collections.abc import Iterable, Iterator
-from typing import List, Any
+import heapq
+import mmap
+import os
+import tracemalloc
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from collections.abc import Iterable, Iterator, Sequence
+from random import choices
+from string import ascii_lowercase
+from typing import Callable, Dict, List, Any, Optional, Tuple, Union
 
 '''
 Для создания итератора в Python есть два абстрактных класса из встроенного
@@ -46,23 +56,379 @@ class AlphabeticalOrderIterator(Iterator):
         return value
 
 
+class ListWordStorage:
+    '''
+    Хранилище слов на обычном списке строк.
+
+    Хранилище поддерживает отсортированный индекс слов. Новые слова сначала
+    попадают в несортированный хвост, а при обходе хвост сортируется и
+    сливается с индексом (Timsort сливает два готовых отрезка за линейное
+    время). Вставка стоит O(1), а первый обход после k вставок — O(n + k log k)
+    вместо полной сортировки на каждом проходе.
+    '''
+
+    def __init__(self):
+        self._words: List[str] = []
+        self._pending: List[str] = []
+
+    def add(self, word: str) -> None:
+        self._pending.append(word)
+
+    def __len__(self) -> int:
+        return len(self._words) + len(self._pending)
+
+    def sorted_view(self) -> Sequence:
+        if self._pending:
+            self._pending.sort()
+            self._words += self._pending
+            self._words.sort()
+            self._pending = []
+        return self._words
+
+
+class ArenaWordStorage:
+    '''
+    Компактное хранилище: все слова лежат подряд в одном буфере UTF-8, а
+    границы слов — в массиве смещений. Вместо отдельного объекта str на каждое
+    слово (50+ байт накладных расходов) тратится 8 байт на смещение и 4 байта
+    на позицию в индексе. Строки декодируются только при обращении к слову.
+
+    Побайтовый порядок UTF-8 совпадает с порядком кодовых точек, поэтому индекс
+    сортируется по байтам без декодирования.
+    '''
+    _run_size = 4096
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offsets = array('Q', [0])
+        self._order = array('I')
+        self._pending = array('I')
+
+    def add(self, word: str) -> None:
+        self._pending.append(len(self._offsets) - 1)
+        self._buffer += word.encode('utf-8')
+        self._offsets.append(len(self._buffer))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def key(self, word_id: int) -> bytes:
+        return bytes(self._buffer[self._offsets[word_id]:self._offsets[word_id + 1]])
+
+    def word(self, word_id: int) -> str:
+        start, stop = self._offsets[word_id], self._offsets[word_id + 1]
+        return self._buffer[start:stop].decode('utf-8')
+
+    def sorted_view(self) -> Sequence:
+        '''
+        Хвост сортируется отрезками по _run_size слов, и отрезки сливаются с
+        индексом потоком. Ключи (срезы буфера) живут только пока слово стоит в
+        голове слияния или в сортируемом отрезке, поэтому пиковая память —
+        два массива позиций, а не по объекту bytes на каждое слово.
+        '''
+        if self._pending:
+            runs = [
+                array('I', sorted(self._pending[start:start + self._run_size], key=self.key))
+                for start in range(0, len(self._pending), self._run_size)
+            ]
+            order = array('I')
+            order.extend(heapq.merge(self._order, *runs, key=self.key))
+            self._order = order
+            self._pending = array('I')
+        return _ArenaView(self, self._order)
+
+
+class _ArenaView(Sequence):
+    '''
+    Отсортированное представление арены: по позиции в индексе лениво
+    декодирует слово. Срез возвращает такое же представление, не копируя слова.
+    '''
+
+    def __init__(self, storage: ArenaWordStorage, order: array):
+        self._storage = storage
+        self._order = order
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __getitem__(self, position: Union[int, slice]) -> Any:
+        if isinstance(position, slice):
+            return _ArenaView(self._storage, self._order[position])
+        return self._storage.word(self._order[position])
+
+
+class ChunkedIterator(Iterator):
+    '''
+    Итератор, который отдаёт не по одному слову, а списками по size слов.
+    Границы пачек вычисляются заранее, поэтому на каждый элемент не приходится
+    ни вызова __next__, ни обработки IndexError.
+    '''
+
+    def __init__(self, collection: Sequence, size: int = 1024, reverse: bool = False):
+        if size < 1:
+            raise ValueError("chunk size must be positive")
+        self._collection = collection
+        self._size = size
+        self._reverse = reverse
+        self._position = len(collection) if reverse else 0
+
+    def __next__(self) -> List[Any]:
+        if self._reverse:
+            if self._position <= 0:
+                raise StopIteration()
+            start = max(0, self._position - self._size)
+            chunk = list(self._collection[start:self._position])
+            chunk.reverse()
+            self._position = start
+        else:
+            if self._position >= len(self._collection):
+                raise StopIteration()
+            stop = self._position + self._size
+            chunk = list(self._collection[self._position:stop])
+            self._position = stop
+        return chunk
+
+
+class MergeIterator(Iterator):
+    '''
+    Лениво сливает несколько уже упорядоченных коллекций (шардов) в один
+    алфавитный поток. Куча хранит по одному текущему слову из каждого шарда,
+    поэтому память — O(k) при k шардах, а шарды не нужно склеивать и
+    пересортировывать. С unique=True повторяющиеся слова выдаются один раз.
+    '''
+    _missing = object()
+
+    def __init__(self, shards: List['WordCollection'], reverse: bool = False,
+                 unique: bool = False):
+        iterators = [shard.get_reverse_iterator() if reverse else iter(shard)
+                     for shard in shards]
+        self._merged = heapq.merge(*iterators, reverse=reverse)
+        self._unique = unique
+        self._last = self._missing
+
+    def __next__(self):
+        value = next(self._merged)
+        if self._unique:
+            while value == self._last:
+                value = next(self._merged)
+            self._last = value
+        return value
+
+
 class WordCollection(Iterable):
     '''
     Конкретные Коллекции предоставляют один или несколько методов для получения
     новых экземпляров итератора, совместимых с классом коллекции.
+
+    Способ хранения слов выбирается параметром storage: 'list' — список
+    строк, 'arena' — компактный буфер UTF-8 (см. ArenaWordStorage).
     '''
+    _storages: Dict[str, type] = {'list': ListWordStorage, 'arena': ArenaWordStorage}
 
-    def __init__(self, words: List[Any] = []):
-        self._collection = words
+    def __init__(self, words: List[Any] = None, storage: str = 'list'):
+        if storage not in self._storages:
+            raise ValueError(f"Unknown storage {storage!r}")
+        self._collection = self._storages[storage]()
+        for word in words or ():
+            self._collection.add(word)
 
     def add_item(self, item: str) -> None:
-        self._collection.append(item)
+        self._collection.add(item)
+
+    def _index(self) -> Sequence:
+        return self._collection.sorted_view()
+
+    def __len__(self) -> int:
+        return len(self._collection)
 
     def __iter__(self) -> AlphabeticalOrderIterator:
-        return AlphabeticalOrderIterator(self._collection)
+        return AlphabeticalOrderIterator(self._index())
 
     def get_reverse_iterator(self) -> AlphabeticalOrderIterator:
-        return AlphabeticalOrderIterator(self._collection, reverse=True)
+        return AlphabeticalOrderIterator(self._index(), reverse=True)
+
+    def chunks(self, size: int = 1024, reverse: bool = False) -> ChunkedIterator:
+        return ChunkedIterator(self._index(), size, reverse)
+
+    def parallel_map(self, func: Callable[[Any], Any], workers: int = None,
+                     chunk_size: int = 10_000) -> List[Any]:
+        '''
+        Применяет func к каждому слову в пуле процессов. Коллекция делится на
+        диапазоны по chunk_size слов, результаты собираются в алфавитном
+        порядке. func должна быть доступна для pickle (функция уровня модуля).
+        '''
+        results: List[Any] = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for part in executor.map(partial(_map_chunk, func), self.chunks(chunk_size)):
+                results.extend(part)
+        return results
+
+    def words_between(self, low: str, high: str,
+                      reverse: bool = False) -> AlphabeticalOrderIterator:
+        '''
+        Слова из полуинтервала [low, high). Границы ищутся двоичным поиском,
+        поэтому просматриваются только слова из диапазона.
+        '''
+        index = self._index()
+        start, stop = bisect_left(index, low), bisect_left(index, high)
+        return AlphabeticalOrderIterator(index[start:stop], reverse=reverse)
+
+    def words_with_prefix(self, prefix: str,
+                          reverse: bool = False) -> AlphabeticalOrderIterator:
+        index = self._index()
+        if not prefix:
+            return AlphabeticalOrderIterator(index[:], reverse=reverse)
+        # Все слова с префиксом лежат до «следующего» префикса, у которого
+        # последний символ увеличен на единицу. Максимальные символы в конце
+        # увеличить нельзя — они отбрасываются, и увеличивается предыдущий.
+        start = bisect_left(index, prefix)
+        upper = prefix.rstrip('\U0010FFFF')
+        if upper:
+            stop = bisect_left(index, upper[:-1] + chr(ord(upper[-1]) + 1), start)
+        else:
+            stop = len(index)
+        return AlphabeticalOrderIterator(index[start:stop], reverse=reverse)
+
+
+class MappedWordCollection(WordCollection):
+    '''
+    Коллекция поверх файла слов (по одному слову UTF-8 в строке, в
+    отсортированном порядке) и файла индекса со смещениями начала строк.
+    Оба файла отображаются в память через mmap, поэтому открытие ничего не
+    читает, а обход в любую сторону подгружает только затронутые страницы.
+    Коллекция доступна только для чтения.
+    '''
+
+    def __init__(self, path: str, index_path: Optional[str] = None):
+        self._path = path
+        self._index_path = index_path or f"{path}.idx"
+        self._maps: List[mmap.mmap] = []
+        self._view = _MappedView(b'', memoryview(array('Q', [0])))
+        if os.path.getsize(self._path) and os.path.getsize(self._index_path):
+            data, offsets = self._map(self._path), self._map(self._index_path)
+            self._view = _MappedView(data, memoryview(offsets).cast('Q'))
+
+    def _map(self, path: str) -> mmap.mmap:
+        with open(path, 'rb') as file:
+            view = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(view)
+        return view
+
+    @staticmethod
+    def build_index(path: str, index_path: Optional[str] = None) -> str:
+        '''
+        Один раз проходит по файлу слов и записывает смещения начала строк и
+        конец файла.
+        '''
+        index_path = index_path or f"{path}.idx"
+        offsets = array('Q', [0])
+        if os.path.getsize(path):
+            with open(path, 'rb') as file, \
+                    mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                position = data.find(b'\n')
+                while position != -1 and position + 1 < len(data):
+                    offsets.append(position + 1)
+                    position = data.find(b'\n', position + 1)
+                offsets.append(len(data))
+        with open(index_path, 'wb') as file:
+            offsets.tofile(file)
+        return index_path
+
+    @classmethod
+    def create(cls, path: str, words: Iterable[str]) -> 'MappedWordCollection':
+        '''
+        Записывает слова на диск в отсортированном порядке вместе с индексом.
+        Слова разделяются переводом строки, поэтому сами его содержать не
+        могут.
+        '''
+        words = sorted(words)
+        for word in words:
+            if '\n' in word:
+                raise ValueError(f"Word {word!r} contains a newline")
+        with open(path, 'wb') as file:
+            for word in words:
+                file.write(word.encode('utf-8') + b'\n')
+        cls.build_index(path)
+        return cls(path)
+
+    def add_item(self, item: str) -> None:
+        raise TypeError("MappedWordCollection is read-only")
+
+    def _index(self) -> Sequence:
+        return self._view
+
+    def __len__(self) -> int:
+        return len(self._view)
+
+    def close(self) -> None:
+        self._view.release()
+        for view in self._maps:
+            view.close()
+        self._maps = []
+
+    def __enter__(self) -> 'MappedWordCollection':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class _MappedView(Sequence):
+    '''
+    Представление слов из отображённого файла по диапазону строк [start, stop).
+    '''
+
+    def __init__(self, data: Any, offsets: memoryview, start: int = 0,
+                 stop: Optional[int] = None):
+        self._data = data
+        self._offsets = offsets
+        self._start = start
+        self._stop = len(offsets) - 1 if stop is None else stop
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, position: Union[int, slice]) -> Any:
+        if isinstance(position, slice):
+            start, stop, step = position.indices(len(self))
+            if step != 1:
+                raise ValueError("MappedWordCollection slices must be contiguous")
+            return _MappedView(self._data, self._offsets,
+                               self._start + start, self._start + max(start, stop))
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("word index out of range")
+        line = self._start + position
+        word = self._data[self._offsets[line]:self._offsets[line + 1]]
+        return word.rstrip(b'\n').decode('utf-8')
+
+    def release(self) -> None:
+        self._offsets.release()
+
+
+def _map_chunk(func: Callable[[Any], Any], chunk: List[Any]) -> List[Any]:
+    return [func(word) for word in chunk]
+
+
+def benchmark_storage(count: int = 100_000, length: int = 8) -> Dict[str, Tuple[int, int]]:
+    '''
+    Сравнивает память, занятую коллекцией из count случайных слов, для обоих
+    способов хранения: итоговую и пиковую (во время построения индекса).
+    '''
+    words = [''.join(choices(ascii_lowercase, k=length)) for _ in range(count)]
+    usage = {}
+    for storage in WordCollection._storages:
+        tracemalloc.start()
+        collection = WordCollection(storage=storage)
+        for word in words:
+            # Копия строки создаётся под трассировкой: так учитываются объекты
+            # str, которые списочное хранилище держит у себя.
+            collection.add_item(word.encode('utf-8').decode('utf-8'))
+        collection._index()
+        usage[storage] = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return usage
 
 
 if __name__ == "__main__":
@@ -72,9 +438,32 @@ if __name__ == "__main__":
     сохранить в своей программе.
     '''
     collection = WordCollection()
-    collection.add_item('First')
     collection.add_item('Second')
     collection.add_item('Third')
+    collection.add_item('First')
 
     print(', '.join(collection))
-    print(', '.join(collection.get_reverse_iterator()))
\ No newline at end of file
+    print(', '.join(collection.get_reverse_iterator()))
+    print(', '.join(collection.words_between('F', 'T')))
+    print(', '.join(collection.words_with_prefix('Th')))
+    print(list(collection.chunks(size=2)))
+    print(collection.parallel_map(len, workers=2, chunk_size=2))
+
+    shard = WordCollection(['Fourth', 'Second'])
+    print(', '.join(MergeIterator([collection, shard], unique=True)))
+    print(', '.join(MergeIterator([collection, shard], reverse=True)))
+
+    arena = WordCollection(['Second', 'Third', 'First'], storage='arena')
+    print(', '.join(arena.get_reverse_iterator()))
+
+    for storage, (used, peak) in benchmark_storage(count=50_000).items():
+        print(f"{storage} storage: {used / 1024:.0f} KiB for 50000 words, peak {peak / 1024:.0f} KiB")
+
+    # Коллекция поверх файла: открывается мгновенно, слова читаются по мере
+    # обхода.
+    from tempfile import TemporaryDirectory
+    with TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'words.txt')
+        MappedWordCollection.create(path, ['Second', 'Third', 'First']).close()
+        with MappedWordCollection(path) as mapped:
+            print(', '.join(mapped.get_reverse_iterator()))
@@ -1,4 +1,11 @@
+import asyncio
+import multiprocessing
+import struct
+import sys
 from abc import ABC, abstractmethod
+from collections import Counter, deque
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Deque, Dict, List, Optional, Tuple
 
 
 class Mediator(ABC):
@@ -78,6 +85,402 @@ class ConcreteMediator(Mediator):
             self._component1.do_b()
 
 
+class MediatorRoutingError(Exception):
+    '''
+    Каскад событий зациклился или оказался глубже допустимого.
+    '''
+
+
+class RoutingMediator(Mediator):
+    '''
+    Посредник, у которого реакции на события хранятся в таблице «событие ->
+    список реакций» вместо цепочки проверок if. Поиск реакций стоит O(1).
+
+    Каскадные события не обрабатываются рекурсивно: notify только ставит
+    событие в очередь, а очередь разбирается циклом в самом внешнем вызове.
+    Для каждого события хранится путь породивших его событий, что позволяет
+    обнаружить цикл и ограничить глубину каскада.
+    '''
+
+    def __init__(self, max_depth: int = 32):
+        self._routes: Dict[str, List[Callable[[], None]]] = {}
+        self._queue: Deque[Tuple[BaseComponent, str, Tuple[str, ...]]] = deque()
+        self._path: Tuple[str, ...] = ()
+        self._dispatching = False
+        self._max_depth = max_depth
+        self.dispatched: Counter = Counter()
+
+    def attach(self, *components: BaseComponent) -> None:
+        for component in components:
+            component.mediator = self
+
+    def register(self, event: str, reaction: Callable[[], None]) -> None:
+        self._routes.setdefault(event, []).append(reaction)
+
+    def notify(self, sender: BaseComponent, event: str) -> None:
+        if event in self._path:
+            raise MediatorRoutingError(f"Cycle: {' -> '.join(self._path + (event,))}")
+        path = self._path + (event,)
+        if len(path) > self._max_depth:
+            raise MediatorRoutingError(f"Cascade is deeper than {self._max_depth} events")
+        self._queue.append((sender, event, path))
+        if self._dispatching:
+            return
+
+        self._dispatching = True
+        try:
+            while self._queue:
+                sender, event, self._path = self._queue.popleft()
+                self.dispatched[event] += 1
+                reactions = self._routes.get(event)
+                if reactions:
+                    print(f"Mediator reacts on '{event}' and triggers following operations:")
+                    for reaction in reactions:
+                        reaction()
+        finally:
+            self._queue.clear()
+            self._path = ()
+            self._dispatching = False
+
+
+class ConcreteRoutingMediator(RoutingMediator):
+    '''
+    Те же реакции, что у ConcreteMediator, но записанные в таблицу.
+    '''
+
+    def __init__(self, component1: ConcreteComponentA, component2: ConcreteComponentB):
+        super().__init__()
+        self.attach(component1, component2)
+        self.register('a', component2.do_c)
+        self.register('c', component1.do_b)
+        self.register('c', component2.do_d)
+        self.register('d', component1.do_b)
+
+
+class AsyncMediator(Mediator):
+    '''
+    Асинхронный посредник. У каждого компонента есть своя ограниченная очередь
+    и своя задача, которая разбирает её. notify лишь раскладывает реакции по
+    очередям компонентов и сразу возвращает управление, не дожидаясь каскада.
+
+    Политика переполнения очереди (overflow):
+    'block' — notify ждёт, пока в очереди освободится место;
+    'drop_oldest' — самая старая реакция в очереди выбрасывается;
+    'reject' — notify выбрасывает asyncio.QueueFull.
+    При 'block' компонент не должен заполнять собственную очередь из своих же
+    реакций — иначе он будет ждать сам себя.
+    '''
+    _policies = ('block', 'drop_oldest', 'reject')
+
+    def __init__(self, maxsize: int = 64, overflow: str = 'block'):
+        if overflow not in self._policies:
+            raise ValueError(f"overflow must be one of {self._policies}")
+        self._maxsize = maxsize
+        self._overflow = overflow
+        self._routes: Dict[str, List[Tuple[BaseComponent, str]]] = {}
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._components: List[BaseComponent] = []
+        self._tasks: List[asyncio.Task] = []
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._running = False
+        self.dropped = 0
+
+    def attach(self, *components: BaseComponent) -> None:
+        '''
+        Компоненты можно подключать и после start: их очередь сразу начинает
+        разбираться.
+        '''
+        for component in components:
+            component.mediator = self
+            self._components.append(component)
+            self._queues[id(component)] = asyncio.Queue(self._maxsize)
+            if self._running:
+                self._tasks.append(asyncio.create_task(self._drain(component)))
+
+    def register(self, event: str, component: BaseComponent, operation: str) -> None:
+        '''
+        На событие event компонент component выполнит свой метод operation.
+        '''
+        self._routes.setdefault(event, []).append((component, operation))
+
+    def start(self) -> None:
+        '''
+        Запускает разбор очередей. Реакции, поставленные в очередь до start,
+        выполнятся после него.
+        '''
+        if self._running:
+            raise RuntimeError("Mediator is already running")
+        self._running = True
+        self._tasks = [asyncio.create_task(self._drain(component))
+                       for component in self._components]
+
+    async def notify(self, sender: BaseComponent, event: str) -> None:
+        for component, operation in self._routes.get(event, ()):
+            queue = self._queues[id(component)]
+            if self._overflow == 'block':
+                self._enqueued()
+                await queue.put(operation)
+                continue
+            if queue.full():
+                if self._overflow == 'reject':
+                    raise asyncio.QueueFull(f"Queue of {type(component).__name__} is full")
+                queue.get_nowait()
+                queue.task_done()
+                self._done()
+                self.dropped += 1
+            self._enqueued()
+            queue.put_nowait(operation)
+
+    def _enqueued(self) -> None:
+        self._pending += 1
+        self._idle.clear()
+
+    def _done(self) -> None:
+        self._pending -= 1
+        if not self._pending:
+            self._idle.set()
+
+    async def _drain(self, component: BaseComponent) -> None:
+        queue = self._queues[id(component)]
+        while True:
+            operation = await queue.get()
+            try:
+                await getattr(component, operation)()
+            except Exception as error:
+                print(f"Mediator: {type(component).__name__}.{operation} failed: {error!r}")
+            finally:
+                queue.task_done()
+                self._done()
+
+    async def wait_quiescent(self) -> None:
+        '''
+        Ждёт, пока все очереди опустеют и все реакции завершатся, включая
+        каскадные.
+        '''
+        await self._idle.wait()
+
+    async def stop(self) -> None:
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+class AsyncComponentA(BaseComponent):
+    async def do_a(self) -> None:
+        print("AsyncComponentA: do_a")
+        await self.mediator.notify(self, "a")
+
+    async def do_b(self) -> None:
+        print("AsyncComponentA: do_b")
+        await self.mediator.notify(self, "b")
+
+
+class AsyncComponentB(BaseComponent):
+    async def do_c(self) -> None:
+        print("AsyncComponentB: do_c")
+        await self.mediator.notify(self, "c")
+
+    async def do_d(self) -> None:
+        print("AsyncComponentB: do_d")
+        await self.mediator.notify(self, "d")
+
+
+async def async_client_code() -> None:
+    c1 = AsyncComponentA()
+    c2 = AsyncComponentB()
+    mediator = AsyncMediator(maxsize=8)
+    mediator.attach(c1, c2)
+    mediator.register('a', c2, 'do_c')
+    mediator.register('c', c1, 'do_b')
+    mediator.register('c', c2, 'do_d')
+    mediator.register('d', c1, 'do_b')
+    mediator.start()
+
+    print("Client triggers operation 'a' asynchronously")
+    await c1.do_a()
+    print("Client: do_a returned, waiting for the cascade")
+    await mediator.wait_quiescent()
+    await mediator.stop()
+
+
+class SharedRing:
+    '''
+    Кольцевой буфер фиксированных ячеек в разделяемой памяти. Сообщения
+    копируются прямо в общую память, без pickle и каналов. Заголовок хранит
+    счётчики записанных (head) и прочитанных (tail) сообщений, семафоры
+    считают свободные и занятые ячейки. Писателей может быть несколько,
+    читатель — один.
+    '''
+    _counter = struct.Struct('<Q')
+    _length = struct.Struct('<H')
+
+    def __init__(self, slots: int = 64, slot_size: int = 256):
+        self._slots = slots
+        self._slot_size = slot_size
+        self._memory = SharedMemory(create=True, size=2 * self._counter.size + slots * slot_size)
+        self._memory.buf[:2 * self._counter.size] = bytes(2 * self._counter.size)
+        self._items = multiprocessing.Semaphore(0)
+        self._spaces = multiprocessing.Semaphore(slots)
+        self._write_lock = multiprocessing.Lock()
+
+    def _slot(self, counter: int) -> int:
+        return 2 * self._counter.size + (counter % self._slots) * self._slot_size
+
+    def put(self, message: bytes) -> None:
+        if len(message) > self._slot_size - self._length.size:
+            raise ValueError("message does not fit into a ring slot")
+        self._spaces.acquire()
+        with self._write_lock:
+            (head,) = self._counter.unpack_from(self._memory.buf, 0)
+            offset = self._slot(head)
+            self._length.pack_into(self._memory.buf, offset, len(message))
+            start = offset + self._length.size
+            self._memory.buf[start:start + len(message)] = message
+            self._counter.pack_into(self._memory.buf, 0, head + 1)
+        self._items.release()
+
+    def get(self) -> bytes:
+        # Читатель один и меняет только tail, а семафор items гарантирует, что
+        # ячейка уже дописана, поэтому блокировка писателей здесь не нужна.
+        self._items.acquire()
+        (tail,) = self._counter.unpack_from(self._memory.buf, self._counter.size)
+        offset = self._slot(tail)
+        (length,) = self._length.unpack_from(self._memory.buf, offset)
+        start = offset + self._length.size
+        message = bytes(self._memory.buf[start:start + length])
+        self._counter.pack_into(self._memory.buf, self._counter.size, tail + 1)
+        self._spaces.release()
+        return message
+
+    def close(self) -> None:
+        self._memory.close()
+
+    def unlink(self) -> None:
+        self._memory.close()
+        self._memory.unlink()
+
+
+class _RingRouter(Mediator):
+    '''
+    Посредник, которого видят компоненты во всех процессах: реакция на
+    событие записывается в кольцевой буфер процесса-получателя. Счётчик
+    незавершённых реакций общий, чтобы родитель мог дождаться затишья.
+    '''
+
+    def __init__(self):
+        self.routes: Dict[str, List[Tuple[str, str]]] = {}
+        self.rings: Dict[str, SharedRing] = {}
+        self._pending = multiprocessing.Value('q', 0)
+        self._idle = multiprocessing.Event()
+        self._idle.set()
+
+    def notify(self, sender: BaseComponent, event: str) -> None:
+        for name, operation in self.routes.get(event, ()):
+            self.send(name, operation)
+
+    def send(self, name: str, operation: str) -> None:
+        with self._pending.get_lock():
+            self._pending.value += 1
+            self._idle.clear()
+        self.rings[name].put(operation.encode('utf-8'))
+
+    def done(self) -> None:
+        with self._pending.get_lock():
+            self._pending.value -= 1
+            if not self._pending.value:
+                self._idle.set()
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        return self._idle.wait(timeout)
+
+
+def _component_worker(component: BaseComponent, ring: SharedRing, router: _RingRouter) -> None:
+    component.mediator = router
+    while True:
+        message = ring.get()
+        if not message:
+            break
+        operation = message.decode('utf-8')
+        try:
+            getattr(component, operation)()
+        except Exception as error:
+            print(f"Mediator: {type(component).__name__}.{operation} failed: {error!r}")
+        finally:
+            sys.stdout.flush()
+            router.done()
+    ring.close()
+
+
+class ProcessMediator(Mediator):
+    '''
+    Посредник, который запускает каждый компонент в отдельном процессе, чтобы
+    реакции, нагружающие процессор, не упирались в GIL. События передаются
+    через кольцевые буферы в разделяемой памяти (SharedRing).
+
+    Компоненты пишутся так же, как для ConcreteMediator: метод вызывает
+    self.mediator.notify(self, "a"), а посредник по таблице маршрутов решает,
+    какой метод какого компонента выполнить. Операции, вызванные клиентом
+    напрямую, выполняются в процессе клиента; trigger выполняет операцию в
+    процессе компонента. Как и у AsyncMediator, реакции не должны переполнять
+    кольцо собственного компонента — писатель будет ждать свободной ячейки.
+    '''
+
+    def __init__(self, components: Dict[str, BaseComponent],
+                 slots: int = 64, slot_size: int = 256):
+        self._components = components
+        self._slots = slots
+        self._slot_size = slot_size
+        self._router = _RingRouter()
+        self._processes: List[multiprocessing.Process] = []
+        for component in components.values():
+            component.mediator = self._router
+
+    def register(self, event: str, component: str, operation: str) -> None:
+        self._router.routes.setdefault(event, []).append((component, operation))
+
+    def notify(self, sender: BaseComponent, event: str) -> None:
+        self._router.notify(sender, event)
+
+    def trigger(self, component: str, operation: str) -> None:
+        self._router.send(component, operation)
+
+    def start(self) -> None:
+        for name in self._components:
+            self._router.rings[name] = SharedRing(self._slots, self._slot_size)
+        for name, component in self._components.items():
+            process = multiprocessing.Process(
+                target=_component_worker,
+                args=(component, self._router.rings[name], self._router),
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+
+    def wait_quiescent(self, timeout: Optional[float] = None) -> bool:
+        return self._router.wait_idle(timeout)
+
+    def stop(self) -> None:
+        for ring in self._router.rings.values():
+            ring.put(b'')
+        for process in self._processes:
+            process.join()
+        for ring in self._router.rings.values():
+            ring.unlink()
+        self._processes = []
+        self._router.rings = {}
+
+    def __enter__(self) -> 'ProcessMediator':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
 if __name__ == "__main__":
     c1 = ConcreteComponentA()
     c2 = ConcreteComponentB()
@@ -90,3 +493,28 @@ if __name__ == "__main__":
 
     print("Client triggers operation 'd'")
     c2.do_d()
+
+    print('')
+
+    mediator = ConcreteRoutingMediator(c1, c2)
+    print("Client triggers operation 'a' through routing table")
+    c1.do_a()
+    print(f"Dispatched events: {dict(mediator.dispatched)}")
+
+    print('')
+
+    asyncio.run(async_client_code())
+
+    print('')
+
+    c1 = ConcreteComponentA()
+    c2 = ConcreteComponentB()
+    process_mediator = ProcessMediator({'component1': c1, 'component2': c2})
+    process_mediator.register('a', 'component2', 'do_c')
+    process_mediator.register('c', 'component1', 'do_b')
+    process_mediator.register('c', 'component2', 'do_d')
+    process_mediator.register('d', 'component1', 'do_b')
+    with process_mediator:
+        print("Client triggers operation 'a' in the worker process", flush=True)
+        process_mediator.trigger('component1', 'do_a')
+        process_mediator.wait_quiescent()
@@ -1,8 +1,19 @@
-from random import sample
+import copy
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import tracemalloc
+import zlib
+from bisect import bisect_right
+from random import randrange, sample
 from string import ascii_letters, digits
 from datetime import datetime
 from abc import ABC, abstractmethod
-from typing import List
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 
 
 class Memento(ABC):
@@ -33,6 +44,131 @@ class ConcreteMemento(Memento):
     def get_date(self) -> str:
         return self._date
 
+    def get_size(self) -> int:
+        return sys.getsizeof(self._state)
+
+
+def _common_prefix(a: str, b: str) -> int:
+    '''
+    Длина общего префикса. Двоичный поиск сравнивает срезы целиком, что
+    быстрее посимвольного цикла на больших строках.
+    '''
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _common_suffix(a: str, b: str, limit: int) -> int:
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:] == b[len(b) - middle:]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _diff(old: str, new: str, block: int = 64) -> List[Tuple[int, int, str]]:
+    '''
+    Разница между состояниями — список замен (начало, конец в old, новый
+    текст). Общие начало и конец отбрасываются; если длина середины не
+    изменилась, она сравнивается блоками и сохраняются только изменённые.
+    '''
+    prefix = _common_prefix(old, new)
+    suffix = _common_suffix(old, new, min(len(old), len(new)) - prefix)
+    old_stop, new_stop = len(old) - suffix, len(new) - suffix
+    if old_stop != new_stop:
+        return [(prefix, old_stop, new[prefix:new_stop])]
+
+    changes: List[Tuple[int, int, str]] = []
+    for start in range(prefix, old_stop, block):
+        stop = min(start + block, old_stop)
+        if old[start:stop] == new[start:stop]:
+            continue
+        if changes and changes[-1][1] == start:
+            start = changes.pop()[0]
+        changes.append((start, stop, new[start:stop]))
+    return changes
+
+
+def _patch(state: str, changes: List[Tuple[int, int, str]]) -> str:
+    pieces, position = [], 0
+    for start, stop, text in changes:
+        pieces.append(state[position:start])
+        pieces.append(text)
+        position = stop
+    pieces.append(state[position:])
+    return ''.join(pieces)
+
+
+class DeltaMemento(Memento):
+    '''
+    Снимок, который хранит не всё состояние, а разницу с предыдущим снимком
+    (изменённые участки строки). Каждый N-й снимок —
+    опорный (keyframe) и хранит состояние целиком. Восстановление идёт от
+    ближайшего опорного снимка вперёд по цепочке разниц.
+    '''
+
+    def __init__(self, state: str, previous: Optional['DeltaMemento'] = None,
+                 previous_state: Optional[str] = None):
+        self._date = str(datetime.now())
+        self._name = state[:19]
+        self._previous = previous
+        if previous is None:
+            self._state: Optional[str] = state
+            self._delta: List[Tuple[int, int, str]] = []
+        else:
+            self._state = None
+            self._delta = _diff(previous_state, state)
+
+    def is_keyframe(self) -> bool:
+        return self._previous is None
+
+    def get_name(self) -> str:
+        return f"{self._date} - {self._name}"
+
+    def get_state(self) -> str:
+        deltas = []
+        memento = self
+        while not memento.is_keyframe():
+            deltas.append(memento._delta)
+            memento = memento._previous
+        state = memento._state
+        for delta in reversed(deltas):
+            state = _patch(state, delta)
+        return state
+
+    def get_date(self) -> str:
+        return self._date
+
+    def rebase(self, removed: 'DeltaMemento', previous: Optional['DeltaMemento']) -> bool:
+        '''
+        Если снимок ссылается на удалённый снимок removed, перецепляет его на
+        previous (разница считается заново) или, когда предыдущего нет,
+        делает опорным. Иначе удалённый снимок и вся цепочка за ним остались
+        бы в памяти. Возвращает True, если снимок изменился.
+        '''
+        if self._previous is not removed:
+            return False
+        state = self.get_state()
+        if previous is None:
+            self._state, self._delta = state, []
+        else:
+            self._delta = _diff(previous.get_state(), state)
+        self._previous = previous
+        return True
+
+    def get_size(self) -> int:
+        if self.is_keyframe():
+            return sys.getsizeof(self._state)
+        return sys.getsizeof(self._delta) + sum(sys.getsizeof(text) for _, _, text in self._delta)
+
 
 class Originator:
     '''
@@ -70,19 +206,251 @@ class Originator:
         print(f"Originator: My state has changed to: {self._state}")
 
 
+class DeltaOriginator(Originator):
+    '''
+    Создатель, который сохраняет состояние разностными снимками с опорным
+    снимком каждые keyframe_interval сохранений.
+    '''
+
+    def __init__(self, state: str, keyframe_interval: int = 16):
+        super().__init__(state)
+        self._keyframe_interval = keyframe_interval
+        self._saved = 0
+        self._last_memento: Optional[DeltaMemento] = None
+        self._last_state: Optional[str] = None
+
+    def save(self) -> Memento:
+        if self._saved % self._keyframe_interval == 0:
+            memento = DeltaMemento(self._state)
+        else:
+            memento = DeltaMemento(self._state, self._last_memento, self._last_state)
+        self._saved += 1
+        self._last_memento, self._last_state = memento, self._state
+        return memento
+
+
+class PersistentDocument(Mapping):
+    '''
+    Неизменяемый вложенный документ. Изменение (set_in) не трогает исходный
+    документ, а копирует только узлы на пути к изменённому ключу; все
+    остальные поддеревья новая и старая версии делят между собой. Поэтому
+    снимок документа — это просто ссылка на текущую версию.
+
+    Ключи — только строки: по ним строятся пути get_in/set_in, и с ними
+    документ однозначно сохраняется в JSON (to_json/from_json).
+    '''
+    __slots__ = ('_data', '_size')
+
+    def __init__(self, data: Optional[Mapping] = None):
+        self._data: Dict[str, Any] = {
+            self._check_key(key): self._freeze(value) for key, value in (data or {}).items()
+        }
+        self._size: Optional[int] = None
+
+    @staticmethod
+    def _check_key(key: Any) -> str:
+        if not isinstance(key, str):
+            raise TypeError(f"Document keys must be str, not {type(key).__name__}")
+        return key
+
+    @classmethod
+    def _wrap(cls, data: Dict[str, Any]) -> 'PersistentDocument':
+        document = cls.__new__(cls)
+        document._data = data
+        document._size = None
+        return document
+
+    @classmethod
+    def _freeze(cls, value: Any) -> Any:
+        '''
+        Изменяемые контейнеры заменяются неизменяемыми, иначе правка списка
+        «на месте» попала бы во все снимки, которые его делят.
+        '''
+        if isinstance(value, PersistentDocument):
+            return value
+        if isinstance(value, Mapping):
+            return cls(value)
+        if isinstance(value, (list, tuple)):
+            return tuple(cls._freeze(item) for item in value)
+        if isinstance(value, (set, frozenset)):
+            return frozenset(cls._freeze(item) for item in value)
+        return value
+
+    @classmethod
+    def _thaw(cls, value: Any) -> Any:
+        if isinstance(value, PersistentDocument):
+            return value.to_dict()
+        if isinstance(value, tuple):
+            return [cls._thaw(item) for item in value]
+        if isinstance(value, frozenset):
+            # Элементы множества и так неизменяемы и должны остаться хешируемыми.
+            return set(value)
+        return value
+
+    @classmethod
+    def _value_size(cls, value: Any) -> int:
+        if isinstance(value, PersistentDocument):
+            return value.deep_size()
+        if isinstance(value, (tuple, frozenset)):
+            return sys.getsizeof(value) + sum(cls._value_size(item) for item in value)
+        return sys.getsizeof(value)
+
+    def __getitem__(self, key: str) -> Any:
+        return self._data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"PersistentDocument({len(self._data)} keys)"
+
+    def get_in(self, path: Sequence[str], default: Any = None) -> Any:
+        node: Any = self
+        for key in path:
+            if not isinstance(node, PersistentDocument) or key not in node._data:
+                return default
+            node = node._data[key]
+        return node
+
+    def set_in(self, path: Sequence[str], value: Any) -> 'PersistentDocument':
+        '''
+        Новая версия документа со значением value по пути path. Стоимость —
+        копирование узлов вдоль пути, а не всего документа.
+        '''
+        if not path:
+            raise ValueError("path must not be empty")
+        key = self._check_key(path[0])
+        data = dict(self._data)
+        if len(path) == 1:
+            data[key] = self._freeze(value)
+        else:
+            child = self._data.get(key)
+            if not isinstance(child, PersistentDocument):
+                child = PersistentDocument()
+            data[key] = child.set_in(path[1:], value)
+        return self._wrap(data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: self._thaw(value) for key, value in self._data.items()}
+
+    def to_json(self) -> str:
+        '''
+        JSON, в котором каждый контейнер помечен своим типом: {"d": ...} —
+        документ, {"l": [...]} — кортеж, {"s": [...]} — множество. Поэтому
+        множества и кортежи переживают сохранение без потерь.
+        '''
+        return json.dumps(self._encode(self))
+
+    @classmethod
+    def from_json(cls, text: str) -> 'PersistentDocument':
+        return cls._decode(json.loads(text))
+
+    @classmethod
+    def _encode(cls, value: Any) -> Any:
+        if isinstance(value, PersistentDocument):
+            return {'d': {key: cls._encode(item) for key, item in value._data.items()}}
+        if isinstance(value, tuple):
+            return {'l': [cls._encode(item) for item in value]}
+        if isinstance(value, frozenset):
+            return {'s': [cls._encode(item) for item in value]}
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        raise TypeError(f"Cannot encode {type(value).__name__} in a document")
+
+    @classmethod
+    def _decode(cls, value: Any) -> Any:
+        if not isinstance(value, dict):
+            return value
+        (tag, items), = value.items()
+        if tag == 'd':
+            return cls._wrap({key: cls._decode(item) for key, item in items.items()})
+        if tag == 'l':
+            return tuple(cls._decode(item) for item in items)
+        return frozenset(cls._decode(item) for item in items)
+
+    def deep_size(self) -> int:
+        '''
+        Оценка памяти, которую удерживает эта версия документа. Узлы
+        неизменяемы, поэтому размер считается один раз и запоминается: для
+        новой версии пересчитываются только скопированные узлы на пути.
+        Поддеревья, общие с другими версиями, входят в размер каждой из них,
+        так что это верхняя оценка.
+        '''
+        if self._size is None:
+            self._size = sys.getsizeof(self._data) + sum(
+                sys.getsizeof(key) + self._value_size(value)
+                for key, value in self._data.items())
+        return self._size
+
+
+class DocumentMemento(ConcreteMemento):
+    '''
+    Снимок документа хранит ссылку на неизменяемую версию, поэтому создаётся
+    за O(1) и не копирует данные.
+    '''
+
+    def get_name(self) -> str:
+        return f"{self._date} - {self._state!r}"
+
+    def get_state(self) -> PersistentDocument:
+        return self._state
+
+    def get_size(self) -> int:
+        return self._state.deep_size()
+
+
+class DocumentOriginator(Originator):
+    '''
+    Создатель, состояние которого — большой вложенный PersistentDocument.
+    '''
+
+    def __init__(self, state: Mapping):
+        super().__init__(PersistentDocument(state))
+
+    def do_something(self) -> None:
+        path = (f"section{randrange(len(self._state) or 1)}", self._generate_random_string(4))
+        self._state = self._state.set_in(path, self._generate_random_string())
+        print(f"I`m doing something important ({'/'.join(path)})")
+
+    def update(self, path: Sequence[str], value: Any) -> None:
+        self._state = self._state.set_in(path, value)
+
+    def save(self) -> Memento:
+        return DocumentMemento(self._state)
+
+
 class Caretaker:
     '''
     Опекун не зависит от класса Конкретного Снимка. Таким образом, он не имеет
     доступа к состоянию создателя, хранящемуся внутри снимка. Он работает со
     всеми снимками через базовый интерфейс Снимка.
+
+    Рядом со снимками опекун хранит отсортированный список моментов их
+    создания по часам time.monotonic(), поэтому снимок на заданный момент
+    находится двоичным поиском.
     '''
 
     def __init__(self, originator: Originator):
         self._originator = originator
         self._mementos: List[Memento] = []
+        self._timestamps: List[float] = []
 
     def create_backup(self) -> None:
-        self._mementos.append(self._originator.save())
+        self._append(self._originator.save())
+
+    def _append(self, memento: Memento) -> None:
+        self._mementos.append(memento)
+        self._timestamps.append(time.monotonic())
+
+    def _truncate(self, index: int) -> None:
+        '''
+        Удаляет из истории снимки, начиная с index.
+        '''
+        del self._mementos[index:]
+        del self._timestamps[index:]
 
     def show_history(self) -> None:
         print("Caretaker: Here's the list of mementos:")
@@ -93,14 +461,452 @@ class Caretaker:
         if not len(self._mementos):
             print("Empty history")
             return
+        self._restore_from(len(self._mementos) - 1, err)
+
+    def restore_n_back(self, n: int, err: bool = False) -> None:
+        '''
+        Откатывается на n снимков назад: restore_n_back(1) равносилен undo().
+        '''
+        if not 1 <= n <= len(self._mementos):
+            raise IndexError(f"History has {len(self._mementos)} mementos, can't go {n} back")
+        self._restore_from(len(self._mementos) - n, err)
+
+    def restore_at(self, timestamp: float, err: bool = False) -> None:
+        '''
+        Восстанавливает последний снимок, сделанный не позже timestamp (по
+        часам time.monotonic()).
+        '''
+        index = bisect_right(self._timestamps, timestamp) - 1
+        if index < 0:
+            raise ValueError("No memento was created before this moment")
+        self._restore_from(index, err)
 
-        memento = self._mementos.pop()
-        print(f"Caretaker: Restoring state to: {memento.get_name()}")
-        try:
-            self._originator.restore(memento, err)
-        except:
-            print("I can`t restore state, try restore previous state")
-            self.undo()
+    def _restore_from(self, index: int, err: bool) -> None:
+        '''
+        Восстанавливает снимок index, отбрасывая его и более новые. Если
+        восстановление не удалось, пробует предыдущие снимки — в цикле, а не
+        рекурсией, так что длинная серия ошибок не переполнит стек.
+        '''
+        while index >= 0:
+            memento = self._mementos[index]
+            print(f"Caretaker: Restoring state to: {memento.get_name()}")
+            try:
+                self._originator.restore(memento, err)
+                return
+            except Exception:
+                print("I can`t restore state, try restore previous state")
+                err = False
+            finally:
+                # Снимок читается до усечения истории: хранилище может
+                # освободить его данные.
+                self._truncate(index)
+            index -= 1
+        print("Empty history")
+
+
+class EvictionPolicy(ABC):
+    '''
+    Политика вытеснения решает, какой снимок удалить, когда история вышла за
+    пределы бюджета, и какие снимки устарели сами по себе.
+    '''
+
+    def expired(self, age: float) -> bool:
+        return False
+
+    @abstractmethod
+    def victim(self, entries: List[Tuple[float, int]]) -> int:
+        '''
+        Индекс удаляемого снимка. entries — снимки от старых к новым: возраст в
+        секундах и сколько снимков сделано после данного.
+        '''
+        pass
+
+
+class RingBufferPolicy(EvictionPolicy):
+    '''
+    Кольцевой буфер: вытесняется самый старый снимок.
+    '''
+
+    def victim(self, entries: List[Tuple[float, int]]) -> int:
+        return 0
+
+
+class ThinningPolicy(EvictionPolicy):
+    '''
+    Экспоненциальное прореживание: снимки делятся на уровни по тому, сколько
+    снимков сделано после них (1, 2-3, 4-7, 8-15...), и на каждом уровне
+    остаётся не больше per_level снимков. Недавняя история остаётся плотной,
+    старая — редкой.
+    '''
+
+    def __init__(self, per_level: int = 2):
+        self._per_level = per_level
+
+    def victim(self, entries: List[Tuple[float, int]]) -> int:
+        levels: Dict[int, List[int]] = {}
+        for index, (_, distance) in enumerate(entries):
+            levels.setdefault(distance.bit_length(), []).append(index)
+        for level in sorted(levels, reverse=True):
+            if len(levels[level]) > self._per_level:
+                # Самый старый снимок уровня остаётся опорой для более
+                # старой истории, удаляется следующий за ним.
+                return levels[level][1]
+        return 0
+
+
+class ExpiryPolicy(EvictionPolicy):
+    '''
+    Снимки старше ttl секунд удаляются независимо от бюджета.
+    '''
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+
+    def expired(self, age: float) -> bool:
+        return age > self._ttl
+
+    def victim(self, entries: List[Tuple[float, int]]) -> int:
+        return 0
+
+
+class BoundedCaretaker(Caretaker):
+    '''
+    Опекун с ограниченной историей: по числу снимков (max_count) и по их
+    оценочному размеру в байтах (max_bytes). Что удалять при превышении,
+    решает политика вытеснения.
+    '''
+
+    def __init__(self, originator: Originator, max_count: Optional[int] = None,
+                 max_bytes: Optional[int] = None, policy: EvictionPolicy = None):
+        super().__init__(originator)
+        self._max_count = max_count
+        self._max_bytes = max_bytes
+        self._policy = policy or RingBufferPolicy()
+        self._meta: List[Tuple[int, int]] = []
+        self._saved = 0
+        self._bytes = 0
+        self._evicted = 0
+        self._expired = 0
+
+    @staticmethod
+    def _estimate_size(memento: Memento) -> int:
+        get_size = getattr(memento, 'get_size', None)
+        if get_size is not None:
+            return get_size()
+        return sys.getsizeof(memento.get_state())
+
+    def _append(self, memento: Memento) -> None:
+        super()._append(memento)
+        size = self._estimate_size(memento)
+        self._meta.append((size, self._saved))
+        self._saved += 1
+        self._bytes += size
+        self._enforce()
+
+    def _remove(self, index: int) -> None:
+        removed = self._mementos.pop(index)
+        del self._timestamps[index]
+        size, _ = self._meta.pop(index)
+        self._bytes -= size
+        if isinstance(removed, DeltaMemento) and index < len(self._mementos):
+            successor = self._mementos[index]
+            previous = self._mementos[index - 1] if index else None
+            if not isinstance(previous, DeltaMemento):
+                previous = None
+            if isinstance(successor, DeltaMemento) and successor.rebase(removed, previous):
+                old_size, number = self._meta[index]
+                new_size = self._estimate_size(successor)
+                self._meta[index] = (new_size, number)
+                self._bytes += new_size - old_size
+
+    def _truncate(self, index: int) -> None:
+        super()._truncate(index)
+        for size, _ in self._meta[index:]:
+            self._bytes -= size
+        del self._meta[index:]
+
+    def _enforce(self) -> None:
+        now = time.monotonic()
+        index = 0
+        while index < len(self._timestamps):
+            if self._policy.expired(now - self._timestamps[index]):
+                self._remove(index)
+                self._expired += 1
+            else:
+                index += 1
+
+        while self._mementos and (
+                (self._max_count is not None and len(self._mementos) > self._max_count)
+                or (self._max_bytes is not None and self._bytes > self._max_bytes)):
+            latest = self._saved - 1
+            self._remove(self._policy.victim([
+                (now - created, latest - number)
+                for created, (_, number) in zip(self._timestamps, self._meta)
+            ]))
+            self._evicted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            'count': len(self._mementos),
+            'bytes': self._bytes,
+            'max_count': self._max_count,
+            'max_bytes': self._max_bytes,
+            'evicted': self._evicted,
+            'expired': self._expired,
+            'oldest_age': now - self._timestamps[0] if self._timestamps else 0.0,
+            'newest_age': now - self._timestamps[-1] if self._timestamps else 0.0,
+        }
+
+
+class StoredMemento(Memento):
+    '''
+    Снимок, состояние которого лежит на диске в сжатом виде. В памяти
+    остаются только метаданные; get_state читает и распаковывает состояние
+    при обращении.
+    '''
+
+    def __init__(self, store: 'DiskMementoStore', offset: int, length: int,
+                 date: str, name: str, kind: str = 'text', checksum: Optional[int] = None):
+        self._store = store
+        self._offset = offset
+        self._length = length
+        self._date = date
+        self._name = name
+        self._kind = kind
+        self._checksum = checksum
+
+    @property
+    def end(self) -> int:
+        return self._offset + self._length
+
+    def get_name(self) -> str:
+        return self._name
+
+    def get_state(self) -> Any:
+        return self._store.read(self._offset, self._length, self._kind, self._checksum)
+
+    def get_date(self) -> str:
+        return self._date
+
+    def get_size(self) -> int:
+        return self._length
+
+
+class DiskMementoStore:
+    '''
+    Сегментный файл снимков. Каждая запись — заголовок (длины, crc32
+    состояния и crc32 самого заголовка вместе с метаданными), метаданные
+    (дата, имя и вид состояния в JSON) и сжатое zlib состояние. Строка
+    хранится как есть, PersistentDocument — как JSON.
+
+    При открытии читаются и проверяются только заголовки и метаданные;
+    состояние целиком проверяется лишь у последней записи, где мог оборваться
+    недописанный хвост. Остальные состояния читаются через mmap по
+    требованию и проверяются при чтении.
+    '''
+    _header = struct.Struct('<IIII')
+    _lengths = struct.Struct('<III')
+
+    def __init__(self, path: str, sync: bool = False):
+        self._path = path
+        self._sync = sync
+        self._file = open(path, 'a+b')
+        self._map: Optional[mmap.mmap] = None
+        self._mementos: List[StoredMemento] = []
+        self._load()
+
+    def _load(self) -> None:
+        size = os.path.getsize(self._path)
+        offset = 0
+        self._file.seek(0)
+        while offset + self._header.size <= size:
+            header = self._file.read(self._header.size)
+            meta_length, payload_length, checksum, head_checksum = self._header.unpack(header)
+            payload_offset = offset + self._header.size + meta_length
+            if payload_offset + payload_length > size:
+                break
+            meta = self._file.read(meta_length)
+            if zlib.crc32(meta, zlib.crc32(header[:self._lengths.size])) != head_checksum:
+                break
+            meta = json.loads(meta.decode('utf-8'))
+            self._mementos.append(StoredMemento(self, payload_offset, payload_length,
+                                                meta['date'], meta['name'],
+                                                meta.get('kind', 'text'), checksum))
+            tail_start, offset = offset, payload_offset + payload_length
+            self._file.seek(offset)
+        if self._mementos:
+            # Обрыв мог задеть состояние последней записи при целом заголовке.
+            tail = self._mementos[-1]
+            self._file.seek(tail._offset)
+            if zlib.crc32(self._file.read(tail._length)) != tail._checksum:
+                offset = tail_start
+        if offset < size:
+            # Недописанная или испорченная запись после сбоя; всё, что после
+            # неё, тоже не доверяем.
+            self.truncate(offset)
+
+    def mementos(self) -> List[StoredMemento]:
+        return list(self._mementos)
+
+    def append(self, memento: Memento) -> StoredMemento:
+        name = memento.get_name() if hasattr(memento, 'get_name') else memento.get_date()
+        kind, text = self._encode(memento.get_state())
+        meta = json.dumps({'date': memento.get_date(), 'name': name, 'kind': kind}).encode('utf-8')
+        payload = zlib.compress(text.encode('utf-8'))
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        lengths = self._lengths.pack(len(meta), len(payload), zlib.crc32(payload))
+        header = lengths + struct.pack('<I', zlib.crc32(meta, zlib.crc32(lengths)))
+        self._file.write(header + meta + payload)
+        self._file.flush()
+        if self._sync:
+            os.fsync(self._file.fileno())
+        stored = StoredMemento(self, offset + self._header.size + len(meta), len(payload),
+                               memento.get_date(), name, kind, zlib.crc32(payload))
+        self._mementos.append(stored)
+        return stored
+
+    @staticmethod
+    def _encode(state: Any) -> Tuple[str, str]:
+        if isinstance(state, str):
+            return 'text', state
+        if isinstance(state, PersistentDocument):
+            return 'document', state.to_json()
+        raise TypeError(f"Cannot store state of type {type(state).__name__}")
+
+    def read(self, offset: int, length: int, kind: str = 'text',
+             checksum: Optional[int] = None) -> Any:
+        if self._map is None or offset + length > len(self._map):
+            self._unmap()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        payload = self._map[offset:offset + length]
+        if checksum is not None and zlib.crc32(payload) != checksum:
+            raise ValueError(f"Memento at offset {offset} in {self._path} is corrupted")
+        text = zlib.decompress(payload).decode('utf-8')
+        if kind == 'document':
+            return PersistentDocument.from_json(text)
+        return text
+
+    def truncate(self, offset: int) -> None:
+        '''
+        Удаляет с диска все записи после offset.
+        '''
+        self._unmap()
+        self._file.truncate(offset)
+        self._file.flush()
+        while self._mementos and self._mementos[-1].end > offset:
+            self._mementos.pop()
+
+    def _unmap(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def close(self) -> None:
+        self._unmap()
+        self._file.close()
+
+
+class PersistentCaretaker(Caretaker):
+    '''
+    Опекун, история которого хранится в DiskMementoStore и переживает
+    перезапуск. show_history работает только с метаданными и не читает
+    состояния с диска.
+    '''
+
+    def __init__(self, originator: Originator, path: str, sync: bool = False):
+        super().__init__(originator)
+        self._store = DiskMementoStore(path, sync)
+        # Монотонные часы не переживают перезапуск, поэтому загруженные снимки
+        # считаются сделанными в момент открытия.
+        self._mementos = self._store.mementos()
+        self._timestamps = [time.monotonic()] * len(self._mementos)
+
+    def _append(self, memento: Memento) -> None:
+        super()._append(self._store.append(memento))
+
+    def _truncate(self, index: int) -> None:
+        super()._truncate(index)
+        self._store.truncate(self._mementos[-1].end if self._mementos else 0)
+
+    def close(self) -> None:
+        self._store.close()
+
+
+def benchmark_mementos(saves: int = 1000, size: int = 100_000, edits: int = 4,
+                       keyframe_interval: int = 16) -> Dict[str, Dict[str, float]]:
+    '''
+    Сравнивает полные и разностные снимки большого состояния, в котором между
+    сохранениями меняется несколько символов: память истории и среднее время
+    восстановления.
+    '''
+    report = {}
+    initial = ''.join(ascii_letters[randrange(len(ascii_letters))] for _ in range(size))
+    for mode in ('full', 'delta'):
+        state = initial
+        tracemalloc.start()
+        if mode == 'full':
+            mementos = []
+            for _ in range(saves):
+                for _ in range(edits):
+                    position = randrange(size)
+                    state = state[:position] + 'x' + state[position + 1:]
+                mementos.append(ConcreteMemento(state))
+        else:
+            mementos, previous, previous_state = [], None, None
+            for number in range(saves):
+                for _ in range(edits):
+                    position = randrange(size)
+                    state = state[:position] + 'x' + state[position + 1:]
+                if number % keyframe_interval:
+                    previous = DeltaMemento(state, previous, previous_state)
+                else:
+                    previous = DeltaMemento(state)
+                previous_state = state
+                mementos.append(previous)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        started = time.perf_counter()
+        for memento in mementos:
+            memento.get_state()
+        restore = (time.perf_counter() - started) / saves
+        report[mode] = {'memory_kib': memory / 1024, 'restore_us': restore * 1e6}
+    return report
+
+
+def benchmark_documents(saves: int = 100_000, copy_saves: int = 200,
+                        sections: int = 100, keys: int = 100) -> Dict[str, Dict[str, float]]:
+    '''
+    Сравнивает снимки документа sections x keys: структурно разделяемые
+    (saves сохранений) и глубокие копии обычного dict (copy_saves сохранений —
+    они на порядки медленнее). Между сохранениями меняется одно значение.
+    '''
+    plain = {f"section{i}": {f"key{j}": j for j in range(keys)} for i in range(sections)}
+    report = {}
+    for mode, count in (('shared', saves), ('deepcopy', copy_saves)):
+        document: Any = PersistentDocument(plain) if mode == 'shared' else copy.deepcopy(plain)
+        snapshots = []
+        tracemalloc.start()
+        started = time.perf_counter()
+        for number in range(count):
+            section, key = f"section{number % sections}", f"key{number % keys}"
+            if mode == 'shared':
+                document = document.set_in((section, key), number)
+                snapshots.append(document)
+            else:
+                document[section][key] = number
+                snapshots.append(copy.deepcopy(document))
+        elapsed = time.perf_counter() - started
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report[mode] = {
+            'saves_per_second': count / elapsed,
+            'memory_mib': memory / 2 ** 20,
+            'bytes_per_snapshot': memory / count,
+        }
+    return report
 
 
 if __name__ == "__main__":
@@ -122,4 +928,70 @@ if __name__ == "__main__":
 
     print("Client: Once more!")
     caretaker.undo()
-    
\ No newline at end of file
+
+    print('')
+    print("Client: Jump back in time")
+    for _ in range(3):
+        caretaker.create_backup()
+        originator.do_something()
+    moment = time.monotonic()
+    caretaker.create_backup()
+    originator.do_something()
+    caretaker.restore_at(moment)
+    caretaker.restore_n_back(2)
+
+    print('')
+    print("Client: Delta mementos")
+    delta_originator = DeltaOriginator("Super-puper", keyframe_interval=2)
+    delta_caretaker = Caretaker(delta_originator)
+    for _ in range(3):
+        delta_caretaker.create_backup()
+        delta_originator.do_something()
+    delta_caretaker.show_history()
+    delta_caretaker.undo()
+
+    print('')
+    print("Client: Bounded history with exponential thinning")
+    bounded_originator = Originator("Super-puper")
+    bounded_caretaker = BoundedCaretaker(bounded_originator, max_count=4,
+                                         policy=ThinningPolicy(per_level=1))
+    for _ in range(6):
+        bounded_caretaker.create_backup()
+        bounded_originator.do_something()
+    bounded_caretaker.show_history()
+    print(bounded_caretaker.stats())
+
+    print('')
+    print("Client: Persistent history survives a restart")
+    from tempfile import TemporaryDirectory
+    with TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'mementos.bin')
+        persistent_originator = Originator("Super-puper")
+        persistent_caretaker = PersistentCaretaker(persistent_originator, path)
+        persistent_caretaker.create_backup()
+        persistent_originator.do_something()
+        persistent_caretaker.create_backup()
+        persistent_caretaker.close()
+
+        persistent_caretaker = PersistentCaretaker(persistent_originator, path)
+        persistent_caretaker.show_history()
+        persistent_caretaker.undo()
+        persistent_caretaker.close()
+
+    print('')
+    for mode, result in benchmark_mementos(saves=200).items():
+        print(f"{mode}: {result['memory_kib']:.0f} KiB, restore {result['restore_us']:.1f} us")
+
+    print('')
+    print("Client: Structurally shared document snapshots")
+    document_originator = DocumentOriginator(
+        {f"section{i}": {f"key{j}": j for j in range(100)} for i in range(10)})
+    document_caretaker = Caretaker(document_originator)
+    document_caretaker.create_backup()
+    document_originator.do_something()
+    document_caretaker.create_backup()
+    document_caretaker.show_history()
+    document_caretaker.undo()
+    for mode, result in benchmark_documents(saves=10_000, copy_saves=100).items():
+        print(f"{mode}: {result['saves_per_second']:.0f} saves/s, "
+              f"{result['bytes_per_snapshot']:.0f} bytes per snapshot")
@@ -1,5 +1,9 @@
+import time
+import weakref
 from abc import ABC, abstractmethod
-from typing import List
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from threading import Event, Lock, Thread, Timer
+from typing import Any, Dict, List, Optional, Set, Tuple
 from random import randrange
 
 
@@ -42,25 +46,54 @@ class ConcreteSubject(Subject):
     подписчикам.
     """
 
-    _observers: List[Observer] = []
+    def __init__(self):
+        '''
+        У каждого издателя свой реестр подписчиков: словарь id -> слабая
+        ссылка. Подписка и отписка стоят O(1), порядок оповещения совпадает с
+        порядком подписки, а собранные сборщиком мусора подписчики исчезают из
+        реестра сами.
+        '''
+        self._observers: Dict[int, weakref.ref] = {}
+
+    def _lookup(self, observer: Observer) -> bool:
+        ref = self._observers.get(id(observer))
+        return ref is not None and ref() is observer
 
     def attach(self, observer: Observer) -> None:
-        if observer not in self._observers:
+        if not self._lookup(observer):
             print(f"Attache observer {observer}")
-            self._observers.append(observer)
+            key = id(observer)
+            subject = weakref.ref(self)
+
+            def forget(ref: weakref.ref) -> None:
+                owner = subject()
+                if owner is not None and owner._observers.get(key) is ref:
+                    owner._collected(key)
+
+            self._observers[key] = weakref.ref(observer, forget)
         else:
             print(f"{observer} are already in list subscribsers")
 
+    def _collected(self, key: int) -> None:
+        '''
+        Вызывается, когда подписчик собран сборщиком мусора. Наследники,
+        которые хранят что-то по id подписчика, должны убрать это здесь: id
+        может достаться новому объекту.
+        '''
+        del self._observers[key]
+
     def detach(self, observer: Observer) -> None:
-        if observer in self._observers:
-            self._observers.remove(observer)
+        if self._lookup(observer):
+            del self._observers[id(observer)]
             print(f"Detache observer {observer}")
         else:
             print(f"{observer} are not in list subscribers")
 
     def notify(self) -> None:
-        for observer in self._observers:
-            observer.update(self)
+        for ref in list(self._observers.values()):
+            observer = ref()
+            if observer is not None:
+                observer.update(self)
 
     def some_busines_logic(self):
         print("Some busines logic of ConcreteSubject")
@@ -68,6 +101,539 @@ class ConcreteSubject(Subject):
         self.notify()
 
 
+class SubjectSnapshot:
+    """
+    Неизменяемый снимок состояния издателя, который получают наблюдатели при
+    параллельном оповещении: пока они работают, издатель может менять state.
+    """
+    __slots__ = ('_state',)
+
+    def __init__(self, state: Any):
+        self._state = state
+
+    @property
+    def state(self) -> Any:
+        return self._state
+
+
+class ConcurrentSubject(ConcreteSubject):
+    """
+    Издатель, который рассылает обновления через пул потоков и ждёт каждого
+    наблюдателя не дольше timeout секунд с момента, когда тот начал
+    обрабатывать обновление (время в очереди пула не считается).
+    Наблюдатель, превысивший таймаут slow_strikes раз подряд, переводится в
+    отдельную «медленную» полосу со своим пулом: его не ждут, и он больше не
+    занимает потоки быстрых наблюдателей. Медленный наблюдатель получает
+    только самый свежий снимок, накопившиеся промежуточные пропускаются. Если
+    он снова укладывается в таймаут, он возвращается в основную полосу.
+    """
+
+    def __init__(self, workers: int = 8, slow_workers: int = 2,
+                 timeout: float = 0.1, slow_strikes: int = 3):
+        super().__init__()
+        self._pool = ThreadPoolExecutor(workers)
+        self._slow_pool = ThreadPoolExecutor(slow_workers)
+        self._timeout = timeout
+        self._slow_strikes = slow_strikes
+        self._strikes: Dict[int, int] = {}
+        self._slow: Set[int] = set()
+        self._slow_latest: Dict[int, SubjectSnapshot] = {}
+        self._slow_busy: Set[int] = set()
+        self._lock = Lock()
+
+    def _deliver(self, observer: Observer, snapshot: SubjectSnapshot,
+                 started: List[Optional[float]]) -> float:
+        started[0] = time.monotonic()
+        observer.update(snapshot)
+        return time.monotonic() - started[0]
+
+    def notify(self) -> None:
+        snapshot = SubjectSnapshot(self.state)
+        pending: Dict[Future, Tuple[int, List[Optional[float]]]] = {}
+        for key, ref in list(self._observers.items()):
+            observer = ref()
+            if observer is None:
+                continue
+            if key in self._slow:
+                self._deliver_slow(key, snapshot)
+                continue
+            started: List[Optional[float]] = [None]
+            pending[self._pool.submit(self._deliver, observer, snapshot, started)] = (key, started)
+
+        waiting, timed_out = set(pending), []
+        while waiting:
+            now = time.monotonic()
+            deadlines = []
+            for future in list(waiting):
+                if future.done():
+                    waiting.discard(future)
+                    continue
+                started = pending[future][1][0]
+                if started is None:
+                    continue
+                if now - started >= self._timeout:
+                    timed_out.append(future)
+                    waiting.discard(future)
+                else:
+                    deadlines.append(started + self._timeout)
+            if not waiting:
+                break
+            # Пока наблюдатель не начал работу, его таймаут не идёт — ждём
+            # первого завершения или ближайшего дедлайна.
+            budget = min(deadlines) - now if deadlines else self._timeout
+            wait(waiting, timeout=max(budget, 0), return_when=FIRST_COMPLETED)
+
+        with self._lock:
+            for future, (key, _) in pending.items():
+                if future in timed_out:
+                    continue
+                self._strikes.pop(key, None)
+                if future.exception() is not None:
+                    print(f"Observer failed: {future.exception()!r}")
+            for future in timed_out:
+                key = pending[future][0]
+                self._strikes[key] = self._strikes.get(key, 0) + 1
+                if self._strikes[key] >= self._slow_strikes:
+                    self._slow.add(key)
+                    ref = self._observers.get(key)
+                    print(f"{ref() if ref is not None else 'Observer'} moved to the slow lane")
+
+    def _deliver_slow(self, key: int, snapshot: SubjectSnapshot) -> None:
+        with self._lock:
+            self._slow_latest[key] = snapshot
+            if key in self._slow_busy:
+                return
+            self._slow_busy.add(key)
+        self._slow_pool.submit(self._drain_slow, key)
+
+    def _drain_slow(self, key: int) -> None:
+        '''
+        Доставляет медленному наблюдателю последний снимок, пока новые снимки
+        продолжают поступать.
+        '''
+        while True:
+            with self._lock:
+                snapshot = self._slow_latest.pop(key, None)
+                ref = self._observers.get(key)
+                observer = ref() if ref is not None else None
+                if snapshot is None or observer is None:
+                    self._slow_busy.discard(key)
+                    return
+            try:
+                elapsed = self._deliver(observer, snapshot, [None])
+            except Exception as error:
+                print(f"Observer failed: {error!r}")
+                continue
+            if elapsed <= self._timeout:
+                with self._lock:
+                    self._slow.discard(key)
+                    self._strikes.pop(key, None)
+
+    def detach(self, observer: Observer) -> None:
+        super().detach(observer)
+        with self._lock:
+            self._slow.discard(id(observer))
+            self._strikes.pop(id(observer), None)
+            self._slow_latest.pop(id(observer), None)
+
+    def _collected(self, key: int) -> None:
+        super()._collected(key)
+        with self._lock:
+            self._slow.discard(key)
+            self._strikes.pop(key, None)
+            self._slow_latest.pop(key, None)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown()
+        self._slow_pool.shutdown()
+
+
+class BatchSnapshot(SubjectSnapshot):
+    """
+    Снимок для пакетной доставки: state — последнее состояние, states — все
+    изменения с предыдущей доставки по порядку.
+    """
+    __slots__ = ('_states',)
+
+    def __init__(self, states: Tuple[Any, ...]):
+        super().__init__(states[-1])
+        self._states = states
+
+    @property
+    def states(self) -> Tuple[Any, ...]:
+        return self._states
+
+
+class _Subscription:
+    __slots__ = ('interval', 'batch', 'cursor', 'last_delivery')
+
+    def __init__(self, max_rate: Optional[float], batch: bool, cursor: int):
+        self.interval = 1 / max_rate if max_rate else 0.0
+        self.batch = batch
+        self.cursor = cursor
+        self.last_delivery = float('-inf')
+
+
+class ThrottledSubject(ConcreteSubject):
+    """
+    Издатель для частых изменений состояния. notify только записывает
+    изменение, а наблюдатели получают обновления при flush — вручную или по
+    таймеру (start). Каждый наблюдатель получает либо последнее состояние,
+    либо пакет всех изменений (batch=True), и не чаще своего max_rate раз в
+    секунду. Придержанное ограничением обновление доставляется, как только
+    интервал истечёт, а stop доставляет всё оставшееся без ограничения.
+
+    Журнал изменений нужен только пакетным подпискам; остальным достаточно
+    последнего значения и номера изменения, которое они уже видели.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._subscriptions: Dict[int, _Subscription] = {}
+        self._changes: List[Any] = []
+        self._offset = 0
+        self._version = 0
+        self._latest: Any = None
+        self._lock = Lock()
+        self._stopped = Event()
+        self._ticker: Optional[Thread] = None
+        self._timer: Optional[Timer] = None
+
+    def attach(self, observer: Observer, max_rate: Optional[float] = None,
+               batch: bool = False) -> None:
+        super().attach(observer)
+        with self._lock:
+            self._subscriptions[id(observer)] = _Subscription(max_rate, batch, self._version)
+
+    def detach(self, observer: Observer) -> None:
+        super().detach(observer)
+        with self._lock:
+            self._subscriptions.pop(id(observer), None)
+
+    def notify(self) -> None:
+        with self._lock:
+            self._latest = self.state
+            self._version += 1
+            if any(subscription.batch for subscription in self._subscriptions.values()):
+                self._changes.append(self.state)
+            else:
+                self._changes.clear()
+                self._offset = self._version
+
+    def flush(self, force: bool = False) -> None:
+        '''
+        Доставляет накопленные изменения. С force=True ограничение частоты не
+        применяется.
+        '''
+        deliveries = []
+        now = time.monotonic()
+        next_due = None
+        with self._lock:
+            for key, ref in list(self._observers.items()):
+                subscription = self._subscriptions.get(key)
+                observer = ref()
+                if subscription is None or observer is None or subscription.cursor == self._version:
+                    continue
+                due = subscription.last_delivery + subscription.interval
+                if not force and now < due:
+                    next_due = due if next_due is None else min(next_due, due)
+                    continue
+                if subscription.batch:
+                    start = max(subscription.cursor, self._offset) - self._offset
+                    snapshot = BatchSnapshot(tuple(self._changes[start:]))
+                else:
+                    snapshot = SubjectSnapshot(self._latest)
+                subscription.cursor = self._version
+                subscription.last_delivery = now
+                deliveries.append((observer, snapshot))
+
+            for key in [key for key in self._subscriptions if key not in self._observers]:
+                del self._subscriptions[key]
+            # Изменения, которые уже получили все пакетные подписки, больше не
+            # нужны.
+            keep_from = min((subscription.cursor for subscription in self._subscriptions.values()
+                             if subscription.batch), default=self._version)
+            keep_from = max(keep_from, self._offset)
+            del self._changes[:keep_from - self._offset]
+            self._offset = keep_from
+            if next_due is not None:
+                self._schedule(next_due - now)
+
+        for observer, snapshot in deliveries:
+            observer.update(snapshot)
+
+    def _schedule(self, delay: float) -> None:
+        '''
+        Без тикера придержанные обновления доставит разовый таймер.
+        Вызывается под _lock.
+        '''
+        if self._ticker is not None or self._timer is not None:
+            return
+
+        def fire() -> None:
+            with self._lock:
+                self._timer = None
+            self.flush()
+
+        self._timer = Timer(delay, fire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def start(self, interval: float = 0.01) -> None:
+        self._stopped.clear()
+
+        def tick() -> None:
+            while not self._stopped.wait(interval):
+                self.flush()
+
+        self._ticker = Thread(target=tick, daemon=True)
+        self._ticker.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._ticker is not None:
+            self._ticker.join()
+            self._ticker = None
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self.flush(force=True)
+
+
+class Predicate(ABC):
+    """
+    Условие подписки на состояние издателя.
+    """
+    @abstractmethod
+    def matches(self, state: Any) -> bool:
+        pass
+
+
+class Always(Predicate):
+    def matches(self, state: Any) -> bool:
+        return True
+
+
+class Equals(Predicate):
+    def __init__(self, value: Any):
+        self.value = value
+
+    def matches(self, state: Any) -> bool:
+        return state == self.value
+
+
+class Range(Predicate):
+    """
+    Полуинтервал [low, high); None означает отсутствие границы.
+    """
+    def __init__(self, low: Any = None, high: Any = None):
+        self.low = low
+        self.high = high
+
+    def matches(self, state: Any) -> bool:
+        return ((self.low is None or self.low <= state)
+                and (self.high is None or state < self.high))
+
+
+class _IntervalNode:
+    __slots__ = ('low', 'high', 'key', 'priority', 'max_high', 'left', 'right')
+
+    def __init__(self, low: tuple, high: tuple, key: int):
+        self.low = low
+        self.high = high
+        self.key = key
+        self.priority = randrange(1 << 30)
+        self.max_high = high
+        self.left: Optional['_IntervalNode'] = None
+        self.right: Optional['_IntervalNode'] = None
+
+    def update(self) -> '_IntervalNode':
+        self.max_high = self.high
+        for child in (self.left, self.right):
+            if child is not None and child.max_high > self.max_high:
+                self.max_high = child.max_high
+        return self
+
+
+class _IntervalTree:
+    """
+    Дерево интервалов: декартово дерево по левой границе, где каждый узел
+    помнит наибольшую правую границу в своём поддереве. Вставка и удаление
+    стоят O(log n), поиск интервалов, содержащих точку, — O(k log n) для k
+    найденных. Границы хранятся в виде кортежей, чтобы отсутствующая граница
+    (None) была меньше или больше любого значения.
+    """
+
+    def __init__(self):
+        self._root: Optional[_IntervalNode] = None
+        self._nodes: Dict[int, Tuple[tuple, tuple]] = {}
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._nodes
+
+    @staticmethod
+    def bounds(predicate: Range) -> Tuple[tuple, tuple]:
+        low = (0,) if predicate.low is None else (1, predicate.low)
+        high = (2,) if predicate.high is None else (1, predicate.high)
+        return low, high
+
+    def insert(self, key: int, predicate: Range) -> None:
+        low, high = self.bounds(predicate)
+        self._nodes[key] = (low, high)
+        self._root = self._insert(self._root, _IntervalNode(low, high, key))
+
+    def _insert(self, node: Optional[_IntervalNode], new: _IntervalNode) -> _IntervalNode:
+        if node is None:
+            return new
+        if (new.low, new.key) < (node.low, node.key):
+            node.left = self._insert(node.left, new)
+            if node.left.priority > node.priority:
+                node = self._rotate_right(node)
+        else:
+            node.right = self._insert(node.right, new)
+            if node.right.priority > node.priority:
+                node = self._rotate_left(node)
+        return node.update()
+
+    def remove(self, key: int) -> None:
+        low, _ = self._nodes.pop(key)
+        self._root = self._remove(self._root, (low, key))
+
+    def _remove(self, node: Optional[_IntervalNode], target: tuple) -> Optional[_IntervalNode]:
+        if node is None:
+            return None
+        current = (node.low, node.key)
+        if target < current:
+            node.left = self._remove(node.left, target)
+        elif target > current:
+            node.right = self._remove(node.right, target)
+        elif node.left is None:
+            return node.right
+        elif node.right is None:
+            return node.left
+        elif node.left.priority > node.right.priority:
+            node = self._rotate_right(node)
+            node.right = self._remove(node.right, target)
+        else:
+            node = self._rotate_left(node)
+            node.left = self._remove(node.left, target)
+        return node.update()
+
+    @staticmethod
+    def _rotate_right(node: _IntervalNode) -> _IntervalNode:
+        top = node.left
+        node.left = top.right
+        top.right = node.update()
+        return top.update()
+
+    @staticmethod
+    def _rotate_left(node: _IntervalNode) -> _IntervalNode:
+        top = node.right
+        node.right = top.left
+        top.left = node.update()
+        return top.update()
+
+    def stab(self, state: Any) -> List[int]:
+        found: List[int] = []
+        point = (1, state)
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            # Если ни один интервал поддерева не заходит правее точки, в нём
+            # нечего искать.
+            if node is None or node.max_high <= point:
+                continue
+            stack.append(node.left)
+            if node.low <= point:
+                if point < node.high:
+                    found.append(node.key)
+                stack.append(node.right)
+        return found
+
+
+class IndexedSubject(ConcreteSubject):
+    """
+    Издатель, у которого подписка объявляет условие на состояние. Условия
+    проиндексированы: равенства — в словаре, диапазоны — в дереве интервалов,
+    которое обновляется при каждой подписке и отписке без перестройки.
+    Поэтому notify будит только тех, чьё условие выполнено, в порядке
+    подписки, не перебирая остальных.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._order: Dict[int, int] = {}
+        self._sequence = 0
+        self._always: Set[int] = set()
+        self._equals: Dict[Any, Set[int]] = {}
+        self._equal_values: Dict[int, Any] = {}
+        self._ranges = _IntervalTree()
+
+    def attach(self, observer: Observer, predicate: Predicate = None) -> None:
+        if self._lookup(observer):
+            print(f"{observer} are already in list subscribsers")
+            return
+        if predicate is not None and not isinstance(predicate, (Always, Equals, Range)):
+            raise TypeError(f"Unsupported predicate {type(predicate).__name__}")
+        super().attach(observer)
+        key = id(observer)
+        self._order[key] = self._sequence
+        self._sequence += 1
+        if predicate is None or isinstance(predicate, Always):
+            self._always.add(key)
+        elif isinstance(predicate, Equals):
+            self._equals.setdefault(predicate.value, set()).add(key)
+            self._equal_values[key] = predicate.value
+        else:
+            self._ranges.insert(key, predicate)
+
+    def detach(self, observer: Observer) -> None:
+        super().detach(observer)
+        self._forget(id(observer))
+
+    def _collected(self, key: int) -> None:
+        super()._collected(key)
+        self._forget(key)
+
+    def _forget(self, key: int) -> None:
+        if self._order.pop(key, None) is None:
+            return
+        self._always.discard(key)
+        if key in self._equal_values:
+            value = self._equal_values.pop(key)
+            self._equals[value].discard(key)
+            if not self._equals[value]:
+                del self._equals[value]
+        if key in self._ranges:
+            self._ranges.remove(key)
+
+    def _matching(self, state: Any) -> List[int]:
+        keys = set(self._always)
+        try:
+            keys.update(self._equals.get(state, ()))
+        except TypeError:
+            pass
+        if len(self._ranges) and state is not None:
+            try:
+                keys.update(self._ranges.stab(state))
+            except TypeError:
+                pass
+        return sorted(keys, key=self._order.__getitem__)
+
+    def notify(self) -> None:
+        for key in self._matching(self.state):
+            ref = self._observers.get(key)
+            observer = ref() if ref is not None else None
+            if observer is None:
+                self._forget(key)
+                continue
+            observer.update(self)
+
+
 """
 Конкретные Наблюдатели реагируют на обновления, выпущенные Издателем, к которому
 они прикреплены.
@@ -96,6 +662,27 @@ class ConcreteObserverB(Observer):
     def __str__(self) -> str:
         return 'ConcreteObserverB'
 
+
+class SlowObserver(Observer):
+    def __init__(self, delay: float):
+        self._delay = delay
+
+    def update(self, subject: Subject):
+        time.sleep(self._delay)
+        print(f"SlowObserver finally got state {subject.state}")
+
+    def __str__(self) -> str:
+        return 'SlowObserver'
+
+
+class BatchObserver(Observer):
+    def update(self, subject: Subject):
+        print(f"BatchObserver got {len(subject.states)} changes, latest {subject.state}")
+
+    def __str__(self) -> str:
+        return 'BatchObserver'
+
+
 if __name__ == "__main__":
     subject = ConcreteSubject()
     observer_a = ConcreteObserverA()
@@ -117,4 +704,37 @@ if __name__ == "__main__":
     subject.some_busines_logic()
     print('')
     subject.detach(observer_b)
-    subject.some_busines_logic()
\ No newline at end of file
+    subject.some_busines_logic()
+    print('')
+
+    concurrent_subject = ConcurrentSubject(timeout=0.05, slow_strikes=2)
+    slow_observer = SlowObserver(delay=0.2)
+    concurrent_subject.attach(observer_a)
+    concurrent_subject.attach(slow_observer)
+    for _ in range(3):
+        started = time.monotonic()
+        concurrent_subject.some_busines_logic()
+        print(f"notify took {time.monotonic() - started:.2f}s")
+    concurrent_subject.shutdown()
+    print('')
+
+    throttled_subject = ThrottledSubject()
+    batch_observer = BatchObserver()
+    throttled_subject.attach(observer_b, max_rate=1)
+    throttled_subject.attach(batch_observer, batch=True)
+    for _ in range(1000):
+        throttled_subject.state = randrange(0, 10)
+        throttled_subject.notify()
+    throttled_subject.flush()
+    throttled_subject.state = 7
+    throttled_subject.notify()
+    throttled_subject.flush()
+    print('')
+
+    # Наблюдатели объявляют условие при подписке и просыпаются только тогда,
+    # когда состояние ему удовлетворяет.
+    indexed_subject = IndexedSubject()
+    indexed_subject.attach(observer_a, Range(low=6))
+    indexed_subject.attach(observer_b, Range(high=5))
+    for _ in range(3):
+        indexed_subject.some_busines_logic()